@@ -24,9 +24,15 @@ from neopia.scanner import Scanner
 from neopia.mode import Mode
 from neopia.keyboard import Keyboard
 from neopia.runner import Runner
+from neopia.runner import Runtime
 from neopia.model import DeviceType
 from neopia.model import DataType
+from neopia.dispatcher import OverflowPolicy
+from neopia.dispatcher import Dispatcher
 from neopia.neosoco import Neosoco
+from neopia.neosoco_group import NeosocoGroup
+from neopia.bridge import Bridge
+from neopia.bridge import Arbitration
 from neopia.opencv_camera import Camera
 from neopia.ai_detection import FaceDetection
 from neopia.ai_detection import FaceMeshDetection
@@ -42,13 +48,19 @@ __version__ = "0.1.0"
 __all__ = [
     "DeviceType", 
     "DataType", 
+    "OverflowPolicy", 
     "Neosoco", 
+    "NeosocoGroup", 
+    "Runtime", 
+    "Bridge", 
+    "Arbitration", 
     "Keyboard", 
     "scan", 
     "is_link_mode", 
     "link_mode", 
     "dispose", 
     "set_executable", 
+    "set_error_handler", 
     "wait", 
     "wait_until_ready", 
     "wait_until", 
@@ -71,8 +83,8 @@ def scan():
 def is_link_mode():
     return Mode.is_link_mode()
 
-def link_mode(url='ws://127.0.0.1:59418'):
-    Mode.set_link_mode(url)
+def link_mode(url='ws://127.0.0.1:59418', delta=False, binary=False):
+    Mode.set_link_mode(url, delta, binary)
 
 def dispose():
     Runner.dispose_all()
@@ -80,6 +92,10 @@ def dispose():
 def set_executable(execute):
     Runner.set_executable(execute)
 
+def set_error_handler(handler):
+    Runner.set_error_handler(handler)
+    Dispatcher.get_default().set_error_handler(handler)
+
 def wait(milliseconds):
     Runner.wait(milliseconds)
 
@@ -100,7 +116,7 @@ def parallel(*functions):
 
 # It's called when an abnormal exit as CTRL+C
 def _handle_signal(signal, frame):
-    Runner.shutdown()
+    Runner.shutdown_all()
     raise SystemExit
 signal.signal(signal.SIGINT, _handle_signal) # CTRL+C
 if sys.platform != "win32":
@@ -108,5 +124,5 @@ if sys.platform != "win32":
 
 # It's called for a safe exit by sending initial packet to HW, even a normal exit
 def exit_handler():
-    Runner.shutdown()
+    Runner.shutdown_all()
 atexit.register(exit_handler)
\ No newline at end of file
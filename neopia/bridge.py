@@ -0,0 +1,418 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import base64
+import hashlib
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from timeit import default_timer as timer
+
+from neopia.connector import State
+from neopia.neosoco_neobot import NeosocoLinkNeobot
+
+
+Arbitration = type("Enum", (), {"LATEST": 0, "PRIORITY": 1})
+
+_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_OPCODE_CONTINUATION = 0x0
+_OPCODE_TEXT = 0x1
+_OPCODE_BINARY = 0x2
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+_OPCODE_PONG = 0xa
+# Frames waiting to be sent to one client, about a second of sensory frames for a few robots
+_OUTGOING_CAPACITY = 256
+
+
+def _unmask(payload, mask):
+    length = len(payload)
+    if length == 0:
+        return payload
+    key = int.from_bytes((mask * (length // 4 + 1))[:length], 'little')
+    return (int.from_bytes(payload, 'little') ^ key).to_bytes(length, 'little')
+
+
+class BridgeClient(object):
+    def __init__(self, bridge, sock, address):
+        self._bridge = bridge
+        self._socket = sock
+        self._address = address
+        self._send_lock = threading.Lock()
+        # Each client is sent to by its own thread, so a stalled one falls behind alone
+        self._outgoing = deque()
+        self._outgoing_ready = threading.Condition()
+        self._dropped = 0
+        self._priority = 0
+        self._open = False
+        # Last motoring map of each robot seen from this client, only what changed in it is applied
+        self._last = {}
+        self._frame = 0
+
+    def get_address(self):
+        return self._address
+
+    def get_priority(self):
+        return self._priority
+
+    def is_open(self):
+        return self._open
+
+    def get_dropped(self):
+        return self._dropped
+
+    def _recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Closed')
+            data += chunk
+        return data
+
+    def _handshake(self):
+        request = b''
+        while not b'\r\n\r\n' in request:
+            chunk = self._socket.recv(4096)
+            if not chunk:
+                return False
+            request += chunk
+            if len(request) > 65536:
+                return False
+        lines = request.decode('latin-1').split('\r\n')
+        path = lines[0].split(' ')[1] if len(lines[0].split(' ')) > 1 else '/'
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            return False
+        # A client states its priority as ws://host:port/?priority=N
+        if '?' in path:
+            for pair in path.split('?', 1)[1].split('&'):
+                if pair.startswith('priority='):
+                    try:
+                        self._priority = int(pair[9:])
+                    except ValueError:
+                        pass
+        accept = base64.b64encode(hashlib.sha1((key + _GUID).encode()).digest()).decode()
+        self._socket.sendall(('HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: ' + accept + '\r\n\r\n').encode())
+        return True
+
+    def _read_frame(self):
+        first, second = self._recv_exactly(2)
+        fin = first & 0x80
+        opcode = first & 0x0f
+        length = second & 0x7f
+        if length == 126:
+            length = struct.unpack('>H', self._recv_exactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', self._recv_exactly(8))[0]
+        if second & 0x80:
+            mask = self._recv_exactly(4)
+            payload = _unmask(self._recv_exactly(length), mask)
+        else:
+            payload = self._recv_exactly(length)
+        return fin, opcode, payload
+
+    def _send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        with self._send_lock:
+            self._socket.sendall(header + payload)
+
+    def send(self, text):
+        # Queued for the sender thread. When the client is that far behind its oldest frame is dropped,
+        # a sensory frame carries the whole state of a robot so the newer ones make up for it.
+        with self._outgoing_ready:
+            if self._open == False:
+                return False
+            if len(self._outgoing) >= _OUTGOING_CAPACITY:
+                self._outgoing.popleft()
+                self._dropped += 1
+            self._outgoing.append(text)
+            self._outgoing_ready.notify()
+        return True
+
+    def _send_forever(self):
+        while True:
+            with self._outgoing_ready:
+                while self._open and len(self._outgoing) == 0:
+                    self._outgoing_ready.wait()
+                if self._open == False:
+                    return
+                text = self._outgoing.popleft()
+            try:
+                self._send_frame(_OPCODE_TEXT, text.encode())
+            except:
+                self.close()
+                return
+
+    def close(self):
+        with self._outgoing_ready:
+            if self._open == False:
+                return
+            self._open = False
+            self._outgoing.clear()
+            self._outgoing_ready.notify()
+        # The sender may be stuck in sendall() on a stalled client, closing the socket ends it
+        if self._send_lock.acquire(timeout=0.5):
+            try:
+                self._socket.settimeout(0.5)
+                self._socket.sendall(struct.pack('>BB', 0x80 | _OPCODE_CLOSE, 0))
+            except:
+                pass
+            finally:
+                self._send_lock.release()
+        try:
+            self._socket.close()
+        except:
+            pass
+        self._bridge._remove_client(self)
+
+    def _run(self):
+        try:
+            if self._handshake() == False:
+                self._socket.close()
+                return
+            self._open = True
+            sender = threading.Thread(target=self._send_forever)
+            sender.daemon = True
+            sender.start()
+            self._bridge._add_client(self)
+            message = b''
+            message_opcode = _OPCODE_TEXT
+            while self._open:
+                fin, opcode, payload = self._read_frame()
+                if opcode == _OPCODE_CLOSE:
+                    break
+                elif opcode == _OPCODE_PING:
+                    self._send_frame(_OPCODE_PONG, payload)
+                elif opcode == _OPCODE_PONG:
+                    pass
+                else:
+                    if opcode != _OPCODE_CONTINUATION:
+                        message_opcode = opcode
+                        message = payload
+                    else:
+                        message += payload
+                    if fin:
+                        if message_opcode == _OPCODE_TEXT:
+                            self._bridge._on_message(self, message.decode('utf-8'))
+                        message = b''
+        except:
+            pass
+        self.close()
+
+
+class Bridge(object):
+    # Serves the link protocol for robots connected to this computer, so several processes
+    # in link mode can share them. Sensory frames go to every client, motoring writes are merged.
+    def __init__(self, robots, host='127.0.0.1', port=59418, policy=Arbitration.LATEST, hold_ms=500):
+        self._robots = {}
+        for robot in robots:
+            self._robots['neosoco' + str(robot.get_index())] = robot
+        self._host = host
+        self._port = port
+        self._policy = policy
+        self._hold = hold_ms / 1000.0
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self._owners = {}
+        self._owners_lock = threading.Lock()
+        self._server = None
+        self._running = False
+        self._threads = []
+        self._sequences = {}
+        self._tag = 'Bridge'
+
+    def get_clients(self):
+        return list(self._clients)
+
+    def get_port(self):
+        return self._port
+
+    def start(self):
+        if self._running:
+            return
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self._host, self._port))
+        server.listen(16)
+        # Lets the accept loop see stop(), closing the socket doesn't wake accept() everywhere
+        server.settimeout(0.5)
+        self._port = server.getsockname()[1]
+        self._server = server
+        self._running = True
+        for target in (self._accept_forever, self._publish_forever):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        self._print_message('Listening on ws://{}:{}'.format(self._host, self._port))
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            try:
+                self._server.close()
+            except:
+                pass
+            for client in self.get_clients():
+                client.close()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            self._print_message('Stopped')
+
+    def _accept_forever(self):
+        while self._running:
+            try:
+                sock, address = self._server.accept()
+            except socket.timeout:
+                continue
+            except:
+                break
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = BridgeClient(self, sock, address)
+            thread = threading.Thread(target=client._run)
+            thread.daemon = True
+            thread.start()
+
+    def _add_client(self, client):
+        with self._clients_lock:
+            self._clients = self._clients + [client]
+        self._sequences = {}
+        self._print_message('Client {} connected'.format(client.get_address()))
+
+    def _remove_client(self, client):
+        with self._clients_lock:
+            self._clients = [c for c in self._clients if c is not client]
+        with self._owners_lock:
+            for key in [key for key, owner in self._owners.items() if owner[0] is client]:
+                del self._owners[key]
+        self._print_message('Client {} disconnected'.format(client.get_address()))
+
+    def _get_connection_state(self, robot):
+        neobot = robot._neobot
+        if neobot._is_disposed():
+            return State.DISCONNECTED
+        if neobot._ready:
+            return State.CONNECTED
+        return State.CONNECTING
+
+    def _encode_sensory(self, key, robot):
+        neobot = robot._neobot
+        received = {'module': 'neosoco', 'group': 'neosoco', 'index': robot.get_index(), 'connectionState': self._get_connection_state(robot)}
+        for field, device in NeosocoLinkNeobot._SENSORY_FIELDS:
+            received[field] = getattr(neobot, device)._data[0]
+        return json.dumps(received)
+
+    def _publish_forever(self):
+        # A robot's frame goes out when its serial link has decoded a new packet.
+        # send() only queues it, every client has its own sender thread.
+        target_time = timer()
+        while self._running:
+            clients = self._clients
+            if len(clients) > 0:
+                for key, robot in self._robots.items():
+                    sequence = (robot._neobot._sequence, self._get_connection_state(robot))
+                    if self._sequences.get(key) != sequence:
+                        self._sequences[key] = sequence
+                        text = self._encode_sensory(key, robot)
+                        for client in clients:
+                            client.send(text)
+            target_time += 0.02
+            delay = target_time - timer()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                target_time = timer()
+
+    def _on_message(self, client, text):
+        try:
+            received = json.loads(text)
+        except ValueError:
+            return
+        if 'hello' in received:
+            # Only JSON framing is served here
+            client.send(json.dumps({'framing': 'json'}))
+            return
+        if 'robots' in received:
+            frame = received.get('frame', 0)
+            if received.get('keyframe') == False and received.get('base') != client._frame:
+                client.send(json.dumps({'requestKeyframe': True}))
+            client._frame = frame
+            received = received['robots']
+        for key, motoring in received.items():
+            if isinstance(motoring, dict):
+                self._merge(client, motoring)
+
+    def _accept(self, client, robot, field, now):
+        if self._policy != Arbitration.PRIORITY:
+            return True
+        owner_key = (robot.get_index(), field)
+        with self._owners_lock:
+            owner = self._owners.get(owner_key)
+            if owner is None or owner[0] is client or owner[2] < now or client.get_priority() >= owner[1]:
+                self._owners[owner_key] = (client, client.get_priority(), now + self._hold)
+                return True
+            return False
+
+    def _merge(self, client, motoring):
+        robot = self._robots.get(str(motoring.get('module')) + str(motoring.get('index')))
+        if robot is None:
+            return
+        neobot = robot._neobot
+        last = client._last.setdefault(robot.get_index(), {})
+        now = timer()
+        # One message of a client lands in one motoring packet, both wheels change in the same tick
+        with robot.batch():
+            for field, device, id_field in NeosocoLinkNeobot._MOTORING_FIELDS:
+                if id_field is not None:
+                    # Commands are played whenever the client bumps their id
+                    if not id_field in motoring:
+                        continue
+                    changed = motoring[id_field] != last.get(id_field, 0)
+                    last[id_field] = motoring[id_field]
+                else:
+                    if not field in motoring:
+                        continue
+                    changed = motoring[field] != last.get(field, 0)
+                if changed and field in motoring:
+                    last[field] = motoring[field]
+                    if self._accept(client, robot, field, now):
+                        getattr(neobot, device).write(motoring[field])
+
+    def _print_message(self, message):
+        sys.stdout.write("{} {}\n".format(self._tag, message))
@@ -0,0 +1,114 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import json
+import statistics
+
+
+COLORS = ('white', 'red', 'yellow', 'green', 'blue')
+
+# Factory ranges of the color sensor, a value outside of them is no color
+DEFAULT_RANGES = (
+    ('white', 10, 50),
+    ('red', 51, 90),
+    ('yellow', 91, 130),
+    ('green', 131, 170),
+    ('blue', 171, 210)
+)
+
+
+class ColorClassifier(object):
+    def __init__(self, ranges=DEFAULT_RANGES):
+        self.set_ranges(ranges)
+
+    def get_ranges(self):
+        return self._ranges
+
+    def set_ranges(self, ranges):
+        # Code 0 is no color, code i is COLORS[i - 1]
+        lut = bytearray(256)
+        checked = []
+        for name, low, high in ranges:
+            if not name in COLORS:
+                raise ValueError('Wrong value of color')
+            low = max(0, int(low))
+            high = min(255, int(high))
+            if low <= high:
+                lut[low:high + 1] = bytes((COLORS.index(name) + 1,)) * (high + 1 - low)
+            checked.append((name, low, high))
+        names = (None,) + COLORS
+        self._ranges = tuple(checked)
+        self._lut = bytes(lut)
+        self._table = tuple(names[code] for code in lut)
+
+    def classify(self, value):
+        value = int(value)
+        if value < 0 or value > 255:
+            return None
+        return self._table[value]
+
+    def classify_codes(self, values):
+        # Vectorized path for buffered samples, it returns the color code of each value.
+        # NumPy is needed only here, it isn't a dependency of the package.
+        import numpy as np
+        values = np.clip(np.asarray(values), 0, 255).astype(np.intp)
+        return np.frombuffer(self._lut, dtype=np.uint8)[values]
+
+    def classify_array(self, values):
+        import numpy as np
+        names = np.array((None,) + COLORS, dtype=object)
+        return names[self.classify_codes(values)]
+
+    @staticmethod
+    def from_samples(samples):
+        # samples maps a color name to the sensor values read on it. Thresholds are put
+        # at the midpoints between the medians of neighbouring colors.
+        medians = []
+        for name, values in samples.items():
+            if not name in COLORS:
+                raise ValueError('Wrong value of color')
+            if len(values) == 0:
+                raise ValueError('No samples of ' + name)
+            medians.append((float(statistics.median(values)), name))
+        medians.sort()
+        ranges = []
+        for i, (median, name) in enumerate(medians):
+            if i > 0:
+                low = int((medians[i - 1][0] + median) / 2) + 1
+            elif len(medians) > 1:
+                low = int(median - (medians[1][0] - median) / 2)
+            else:
+                low = 0
+            if i < len(medians) - 1:
+                high = int((median + medians[i + 1][0]) / 2)
+            elif len(medians) > 1:
+                high = int(median + (median - medians[i - 1][0]) / 2)
+            else:
+                high = 255
+            ranges.append((name, low, high))
+        return ColorClassifier(ranges)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'ranges': [list(r) for r in self._ranges]}, f, indent=2)
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            data = json.load(f)
+        return ColorClassifier([tuple(r) for r in data['ranges']])
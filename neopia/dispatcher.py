@@ -0,0 +1,223 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import threading
+import queue
+from collections import deque, OrderedDict
+
+from neopia.invoker import report_error
+
+
+OverflowPolicy = type("Enum", (), {"DROP_OLDEST": 0, "COALESCE_LATEST": 1, "BLOCK": 2})
+
+DEFAULT_CAPACITY = 64
+DEFAULT_WORKERS = 4
+DRAIN_BATCH = 16
+
+
+class ListenerQueue(object):
+    def __init__(self, dispatcher, invoke, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
+        self._dispatcher = dispatcher
+        self._invoke = invoke
+        self._capacity = max(1, int(capacity))
+        self._policy = policy
+        if policy == OverflowPolicy.COALESCE_LATEST:
+            self._items = OrderedDict()
+        else:
+            self._items = deque()
+        self._condition = threading.Condition()
+        self._scheduled = False
+        self._max_depth = 0
+        self._dropped = 0
+        self._delivered = 0
+
+    def get_policy(self):
+        return self._policy
+
+    def get_capacity(self):
+        return self._capacity
+
+    def get_depth(self):
+        return len(self._items)
+
+    def get_max_depth(self):
+        return self._max_depth
+
+    def get_dropped(self):
+        return self._dropped
+
+    def get_delivered(self):
+        return self._delivered
+
+    def put(self, key, args):
+        items = self._items
+        with self._condition:
+            if self._policy == OverflowPolicy.COALESCE_LATEST:
+                if key in items:
+                    # Keep the position in the queue, only the newest arguments are delivered
+                    items[key] = args
+                    self._dropped += 1
+                    return
+                if len(items) >= self._capacity:
+                    items.popitem(last=False)
+                    self._dropped += 1
+                items[key] = args
+            else:
+                if len(items) >= self._capacity:
+                    if self._policy == OverflowPolicy.BLOCK:
+                        while len(items) >= self._capacity and self._dispatcher._running:
+                            self._condition.wait(0.1)
+                    else:
+                        items.popleft()
+                        self._dropped += 1
+                items.append(args)
+            depth = len(items)
+            if depth > self._max_depth:
+                self._max_depth = depth
+            schedule = not self._scheduled
+            self._scheduled = True
+        if schedule:
+            self._dispatcher._schedule(self)
+
+    def _pop(self):
+        items = self._items
+        if self._policy == OverflowPolicy.COALESCE_LATEST:
+            return items.popitem(last=False)[1]
+        return items.popleft()
+
+    def _drain(self):
+        # Deliver a batch and go to the back of the line so that one busy listener can't hog a worker
+        for i in range(DRAIN_BATCH):
+            with self._condition:
+                if len(self._items) == 0:
+                    self._scheduled = False
+                    return
+                args = self._pop()
+                self._condition.notify()
+            try:
+                self._invoke(*args)
+            except Exception as e:
+                self._dispatcher._report_error(e, self._invoke)
+            self._delivered += 1
+        with self._condition:
+            if len(self._items) == 0:
+                self._scheduled = False
+                return
+        self._dispatcher._schedule(self)
+
+
+class Dispatcher(object):
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self._workers = max(1, int(workers))
+        self._queues = {}
+        # Registrations sharing the queue of each listener, the queue goes with the last one
+        self._refs = {}
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = False
+        self._error_handler = None
+
+    @staticmethod
+    def get_default():
+        if Dispatcher._default is None:
+            with Dispatcher._default_lock:
+                if Dispatcher._default is None:
+                    Dispatcher._default = Dispatcher()
+        return Dispatcher._default
+
+    def get_queue(self, listener, invoke=None, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
+        # Every call is a registration to be matched by a release(). A listener has one queue,
+        # registering it again with another capacity or policy is an error.
+        with self._lock:
+            listener_queue = self._queues.get(listener)
+            if listener_queue is None:
+                listener_queue = ListenerQueue(self, invoke or listener, capacity, policy)
+                self._queues[listener] = listener_queue
+            elif listener_queue.get_capacity() != max(1, int(capacity)) or listener_queue.get_policy() != policy:
+                raise ValueError('Listener already has a queue of another capacity or policy')
+            self._refs[listener] = self._refs.get(listener, 0) + 1
+        return listener_queue
+
+    def set_error_handler(self, handler):
+        # handler(error, listener) is called on the worker thread for a listener that raised
+        self._error_handler = handler
+
+    def _report_error(self, error, source):
+        report_error(self._error_handler, error, source)
+
+    def release(self, listener):
+        with self._lock:
+            refs = self._refs.get(listener, 0) - 1
+            if refs > 0:
+                self._refs[listener] = refs
+            else:
+                self._refs.pop(listener, None)
+                self._queues.pop(listener, None)
+
+    def get_metrics(self):
+        metrics = {}
+        for listener, listener_queue in list(self._queues.items()):
+            metrics[listener] = {
+                'depth': listener_queue.get_depth(),
+                'max_depth': listener_queue.get_max_depth(),
+                'dropped': listener_queue.get_dropped(),
+                'delivered': listener_queue.get_delivered()
+            }
+        return metrics
+
+    def _schedule(self, listener_queue):
+        if self._running == False:
+            self._start()
+        self._ready.put(listener_queue)
+
+    def _start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        ready = self._ready
+        while True:
+            listener_queue = ready.get()
+            if listener_queue is None:
+                break
+            listener_queue._drain()
+
+    def shutdown(self):
+        with self._lock:
+            if self._running == False:
+                return
+            self._running = False
+            threads = self._threads
+            self._threads = []
+            for listener_queue in self._queues.values():
+                listener_queue._scheduled = False
+        for thread in threads:
+            self._ready.put(None)
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,119 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import struct
+
+
+MAGIC = 0x4e
+VERSION = 1
+FRAME_MOTORING = 1
+FRAME_SENSORY = 2
+FLAG_KEYFRAME = 0x01
+
+# magic, version, frame type, flags, frame number, robot count
+_HEADER = struct.Struct('<BBBBIH')
+# module id, robot index
+_ROBOT = struct.Struct('<BB')
+
+
+class ModuleSchema(object):
+    def __init__(self, module, module_id, fields):
+        # Every field is a signed 16-bit integer in the order of fields
+        self._module = module
+        self._module_id = module_id
+        self._fields = tuple(fields)
+        self._struct = struct.Struct('<%dh' % len(self._fields))
+
+    def get_module(self):
+        return self._module
+
+    def get_module_id(self):
+        return self._module_id
+
+    def get_fields(self):
+        return self._fields
+
+    def get_size(self):
+        return self._struct.size
+
+    def pack(self, values):
+        return self._struct.pack(*[values[field] for field in self._fields])
+
+    def unpack_from(self, buffer, offset):
+        return dict(zip(self._fields, self._struct.unpack_from(buffer, offset)))
+
+
+class BinaryFraming(object):
+    def __init__(self):
+        self._motoring_by_module = {}
+        self._sensory_by_id = {}
+        self._modules = []
+
+    def _module_id(self, module):
+        if not module in self._modules:
+            self._modules.append(module)
+        return self._modules.index(module)
+
+    def register_motoring(self, module, fields):
+        if not module in self._motoring_by_module:
+            self._motoring_by_module[module] = ModuleSchema(module, self._module_id(module), fields)
+
+    def register_sensory(self, module, fields):
+        module_id = self._module_id(module)
+        self._sensory_by_id[module_id] = ModuleSchema(module, module_id, fields)
+
+    def has_motoring(self, module):
+        return module in self._motoring_by_module
+
+    def describe(self):
+        # Sent to the bridge in the hello, so both sides agree on module ids and field order
+        schemas = {}
+        for module, schema in self._motoring_by_module.items():
+            schemas[module] = {'id': schema.get_module_id(), 'motoring': list(schema.get_fields())}
+        return schemas
+
+    def encode_robot(self, motoring):
+        schema = self._motoring_by_module[motoring['module']]
+        return _ROBOT.pack(schema.get_module_id(), motoring['index']) + schema.pack(motoring)
+
+    def encode_frame(self, frame, records, keyframe=False, frame_type=FRAME_MOTORING):
+        # records are the already encoded robots
+        flags = FLAG_KEYFRAME if keyframe else 0
+        header = _HEADER.pack(MAGIC, VERSION, frame_type, flags, frame & 0xffffffff, len(records))
+        return header + b''.join(records)
+
+    def encode_motoring(self, packet, frame=0, keyframe=True):
+        return self.encode_frame(frame, [self.encode_robot(motoring) for motoring in packet.values()], keyframe)
+
+    def decode_sensory(self, data):
+        magic, version, frame_type, flags, frame, count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION or frame_type != FRAME_SENSORY:
+            raise ValueError('Wrong sensory frame')
+        offset = _HEADER.size
+        robots = []
+        sensory_by_id = self._sensory_by_id
+        for i in range(count):
+            module_id, index = _ROBOT.unpack_from(data, offset)
+            offset += _ROBOT.size
+            schema = sensory_by_id[module_id]
+            received = schema.unpack_from(data, offset)
+            offset += schema.get_size()
+            received['module'] = schema.get_module()
+            received['index'] = index
+            robots.append(received)
+        return robots
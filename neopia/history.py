@@ -0,0 +1,121 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+from timeit import default_timer as timer
+
+import numpy as np
+
+
+class SensorHistory(object):
+    def __init__(self, capacity=100):
+        capacity = max(1, int(capacity))
+        self._capacity = capacity
+        # Every sample is written twice, so the last n samples are always one contiguous slice
+        self._values = np.zeros(2 * capacity, dtype=np.float64)
+        self._times = np.zeros(2 * capacity, dtype=np.float64)
+        self._head = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def get_capacity(self):
+        return self._capacity
+
+    def get_count(self):
+        return self._count
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def append(self, value, timestamp=None):
+        if timestamp is None:
+            timestamp = timer()
+        capacity = self._capacity
+        head = self._head
+        values = self._values
+        if self._count < capacity:
+            self._count += 1
+        else:
+            self._sum -= values[head]
+        values[head] = values[head + capacity] = value
+        self._times[head] = self._times[head + capacity] = timestamp
+        self._sum += value
+        head += 1
+        if head == capacity:
+            head = 0
+            # Re-sum once per lap so the running sum doesn't drift
+            self._sum = float(values[:self._count].sum())
+        self._head = head
+
+    def _window(self, n):
+        count = self._count
+        if n is None or n > count:
+            n = count
+        end = self._head + self._capacity
+        return end - n, end
+
+    def values(self, n=None):
+        # Zero-copy view of the last n samples, oldest first. It's overwritten as new samples arrive.
+        start, end = self._window(n)
+        return self._values[start:end]
+
+    def times(self, n=None):
+        start, end = self._window(n)
+        return self._times[start:end]
+
+    def latest(self):
+        if self._count == 0:
+            return 0
+        return self._values[self._head + self._capacity - 1]
+
+    def mean(self, n=None):
+        count = self._count
+        if count == 0:
+            return 0
+        if n is None or n >= count:
+            return self._sum / count
+        return float(self.values(n).mean())
+
+    def minimum(self, n=None):
+        if self._count == 0:
+            return 0
+        return float(self.values(n).min())
+
+    def maximum(self, n=None):
+        if self._count == 0:
+            return 0
+        return float(self.values(n).max())
+
+    def median(self, n=None):
+        if self._count == 0:
+            return 0
+        return float(np.median(self.values(n)))
+
+    def slope(self, n=None):
+        # Least squares slope in value units per second
+        start, end = self._window(n)
+        if end - start < 2:
+            return 0
+        t = self._times[start:end]
+        v = self._values[start:end]
+        dt = t - t.mean()
+        denominator = float(np.dot(dt, dt))
+        if denominator == 0:
+            return 0
+        return float(np.dot(dt, v - v.mean())) / denominator
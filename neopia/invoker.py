@@ -0,0 +1,63 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import sys
+import threading
+import traceback
+import weakref
+from functools import partial
+
+
+# Callables whose error went to stderr already, a condition failing every tick is printed once
+_printed = weakref.WeakSet()
+_printed_lock = threading.Lock()
+
+
+def unwrap(fn):
+    # Static and class method objects aren't callable before Python 3.10, the function inside is
+    if fn is not None and not callable(fn):
+        fn = getattr(fn, '__func__', fn)
+    return fn
+
+
+def bind(fn, arg=None):
+    # Conditions and callbacks get their argument only when one was given
+    fn = unwrap(fn)
+    if fn is None or arg is None:
+        return fn
+    return partial(fn, arg)
+
+
+def report_error(handler, error, source):
+    # handler(error, source) is given the exception and the callable that raised it.
+    # It returns what the handler returned, False asks the caller to drop the callable.
+    if handler is None:
+        try:
+            with _printed_lock:
+                if source in _printed:
+                    return None
+                _printed.add(source)
+        except TypeError:
+            pass
+        sys.stderr.write("Error in {!r}\n".format(source))
+        traceback.print_exception(type(error), error, error.__traceback__)
+        return None
+    try:
+        return handler(error, source)
+    except:
+        return None
@@ -17,13 +17,16 @@
 # Boston, MA  02111-1307  USA
 
 import sys
+import random
+import struct
 import threading
 import time
 from timeit import default_timer as timer
 import websocket
 import json
-from neopia.runner import Runner
 from neopia.connector import State
+from neopia.framing import BinaryFraming
+from neopia.framing import VERSION
 
 
 class Link(object):
@@ -37,8 +40,9 @@ class Link(object):
         return self._neobot.get_motoring()
 
     def handle_sensory(self, received):
-        connection_state = received['connectionState']
-        if connection_state != self._connection_state:
+        # A binary sensory record carries only the fields the bridge announced, the state may be missing
+        connection_state = received.get('connectionState')
+        if connection_state is not None and connection_state != self._connection_state:
             self._connection_state = connection_state
             if connection_state == State.CONNECTING:
                 Linker.print_message(self._tag, 'Connecting')
@@ -68,14 +72,32 @@ class Linker(object):
     _send_thread = None
     _server_state = False
     _opened = False
+    _delta = False
+    _keyframe_interval = 50
+    _frame = 0
+    _frames_since_keyframe = 0
+    _force_keyframe = True
+    _sent = {}
+    _framing = BinaryFraming()
+    _binary = False
+    _binary_active = False
+    _sent_records = {}
+    _links_by_module = {}
+    _pending = {}
+    _pending_lock = threading.Lock()
+    _pending_event = threading.Event()
+    _decode_thread = None
+    _coalesced = 0
+    _connected = threading.Event()
+    _stopped = threading.Event()
+    _attempts = 0
+    _reconnects = 0
+    _BACKOFF_MIN = 0.5
+    _BACKOFF_MAX = 30.0
 
     @staticmethod
     def _get_link(module, index):
-        key = module + str(index)
-        if key in Linker._links:
-            return Linker._links[key]
-        else:
-            return None
+        return Linker._links_by_module.get((module, index))
 
     @staticmethod
     def _get_or_create_link(group, module, index, tag, neobot):
@@ -86,39 +108,203 @@ class Linker(object):
         else:
             link = Link(tag, neobot)
             Linker._links[key] = link
-            Linker._packet[key] = link.get_motoring()
-        Linker._links_by_group[group + index] = link
+            motoring = Linker._packet[key] = link.get_motoring()
+            Linker._framing.register_motoring(module, Linker._get_motoring_fields(neobot, motoring))
+            Linker._links_by_module[(module, int(index))] = link
+        Linker._links_by_group[(group, int(index))] = link
         return link
 
+    @staticmethod
+    def _get_motoring_fields(neobot, motoring):
+        if hasattr(neobot, 'get_motoring_fields'):
+            return neobot.get_motoring_fields()
+        return [field for field in motoring if field != 'module' and field != 'index']
+
     @staticmethod
     def register_neobot(group, module, index, tag, neobot):
         Linker._get_or_create_link(group, module, index, tag, neobot)
 
+    @staticmethod
+    def set_delta_encoding(enabled, keyframe_interval=50):
+        # Only for bridges that understand delta frames. The full state goes out every keyframe_interval frames,
+        # on every (re)connection and whenever the bridge asks for it with 'requestKeyframe'.
+        Linker._delta = bool(enabled)
+        Linker._keyframe_interval = max(1, int(keyframe_interval))
+        Linker._force_keyframe = True
+
+    @staticmethod
+    def is_delta_encoding():
+        return Linker._delta
+
+    @staticmethod
+    def set_binary_framing(enabled):
+        # Offered to the bridge in a hello on connection, JSON is kept when the bridge doesn't accept it
+        Linker._binary = bool(enabled)
+
+    @staticmethod
+    def is_binary_framing():
+        return Linker._binary_active
+
+    @staticmethod
+    def _next_is_keyframe():
+        if Linker._force_keyframe or Linker._frames_since_keyframe + 1 >= Linker._keyframe_interval:
+            Linker._force_keyframe = False
+            Linker._frames_since_keyframe = 0
+            return True
+        Linker._frames_since_keyframe += 1
+        return False
+
+    @staticmethod
+    def _encode_delta():
+        packet = Linker._packet
+        sent = Linker._sent
+        keyframe = Linker._next_is_keyframe()
+        if keyframe:
+            robots = packet
+            for key in packet:
+                sent[key] = dict(packet[key])
+        else:
+            robots = {}
+            for key in packet:
+                motoring = packet[key]
+                last = sent.get(key)
+                if last is None:
+                    sent[key] = dict(motoring)
+                    robots[key] = motoring
+                    continue
+                changed = None
+                for field in motoring:
+                    value = motoring[field]
+                    if field not in last or last[field] != value:
+                        last[field] = value
+                        if changed is None:
+                            changed = {'module': motoring['module'], 'index': motoring['index']}
+                        changed[field] = value
+                if changed is not None:
+                    robots[key] = changed
+            if len(robots) == 0:
+                return None
+        # base is the frame this one applies to, a bridge that missed it asks for a keyframe
+        base = Linker._frame
+        Linker._frame = frame = base + 1
+        return json.dumps({'frame': frame, 'base': base, 'keyframe': keyframe, 'robots': robots})
+
+    @staticmethod
+    def _encode_binary():
+        # The layout of a robot is fixed, so a delta frame only leaves out the robots that haven't changed
+        framing = Linker._framing
+        packet = Linker._packet
+        sent = Linker._sent_records
+        keyframe = Linker._next_is_keyframe() if Linker._delta else True
+        records = []
+        for key in packet:
+            record = framing.encode_robot(packet[key])
+            if keyframe or sent.get(key) != record:
+                sent[key] = record
+                records.append(record)
+        if len(records) == 0:
+            return None
+        Linker._frame = frame = Linker._frame + 1
+        return framing.encode_frame(frame, records, keyframe)
+
+    @staticmethod
+    def _encode():
+        if Linker._binary_active:
+            try:
+                return Linker._encode_binary()
+            except (KeyError, struct.error):
+                Linker._force_keyframe = True
+        if Linker._delta:
+            return Linker._encode_delta()
+        return json.dumps(Linker._packet)
+
     @staticmethod
     def _on_open(wsapp):
+        if Linker._keep_running == False:
+            wsapp.close()
+            return
+        Linker._force_keyframe = True
+        Linker._binary_active = False
+        Linker._sent_records = {}
+        if Linker._binary:
+            try:
+                wsapp.send(json.dumps({'hello': {'version': VERSION, 'framing': ['binary', 'json'], 'schemas': Linker._framing.describe()}}))
+            except:
+                pass
+        Linker._attempts = 0
         Linker._opened = True
         Linker._server_state = True
+        Linker._connected.set()
+
+    @staticmethod
+    def _on_framing(received):
+        # The bridge answers the hello with its framing and the field order of its sensory frames
+        if received['framing'] == 'binary' and Linker._binary:
+            for module, fields in received.get('sensory', {}).items():
+                Linker._framing.register_sensory(module, fields)
+            Linker._force_keyframe = True
+            Linker._binary_active = True
+        else:
+            Linker._binary_active = False
+
+    @staticmethod
+    def _dispatch(received):
+        index = received['index']
+        if index >= 0:
+            link = Linker._links_by_module.get((received['module'], index))
+            if link is None and 'group' in received:
+                link = Linker._links_by_group.get((received['group'], index))
+            if link is not None:
+                # Only the newest message of a link is kept until the decode thread gets to it
+                with Linker._pending_lock:
+                    if link in Linker._pending:
+                        Linker._coalesced += 1
+                    Linker._pending[link] = received
+                Linker._pending_event.set()
+
+    @staticmethod
+    def get_coalesced_count():
+        return Linker._coalesced
+
+    @staticmethod
+    def _decode_forever():
+        event = Linker._pending_event
+        while Linker._keep_running:
+            if event.wait(0.1) == False:
+                continue
+            with Linker._pending_lock:
+                event.clear()
+                pending = Linker._pending
+                Linker._pending = {}
+            for link, received in pending.items():
+                try:
+                    link.handle_sensory(received)
+                except:
+                    pass
 
     @staticmethod
     def _on_close(wsapp, close_status_code, close_msg):
+        # The supervisor reconnects once run_forever() has returned
+        Linker._connected.clear()
         Linker._opened = False
         Linker._server_state = False
-        if Linker._keep_running:
-            Runner.wait(500)
-            if Linker._opened == False:
-                Linker._open()
+        Linker._binary_active = False
 
     @staticmethod
     def _on_message(wsapp, message):
         try:
+            if isinstance(message, bytes):
+                for received in Linker._framing.decode_sensory(message):
+                    Linker._dispatch(received)
+                return
             received = json.loads(message)
-            index = received['index']
-            if index >= 0:
-                link = Linker._get_link(received['module'], index)
-                if link is None:
-                    link = Linker._get_link(received['group'], index)
-                if link is not None:
-                    link.handle_sensory(received)
+            if received.get('requestKeyframe'):
+                Linker._force_keyframe = True
+                return
+            if 'framing' in received:
+                Linker._on_framing(received)
+                return
+            Linker._dispatch(received)
         except:
             pass
 
@@ -126,37 +312,69 @@ class Linker(object):
     def _on_error(wsapp, ex):
         pass
 
+    @staticmethod
+    def _get_backoff(attempts):
+        # Exponential backoff with jitter, so several clients don't reconnect in lockstep after a bridge restart
+        delay = min(Linker._BACKOFF_MAX, Linker._BACKOFF_MIN * (2 ** min(attempts, 16)))
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def get_reconnect_count():
+        return Linker._reconnects
+
+    @staticmethod
+    def is_connected():
+        return Linker._connected.is_set()
+
     @staticmethod
     def _open():
-        try:
-            Linker._wsapp = websocket.WebSocketApp(Linker._url, on_open=Linker._on_open, on_close=Linker._on_close, on_message=Linker._on_message, on_error=Linker._on_error)
-            Linker._wsapp.run_forever()
-        except:
-            pass
+        # One connection at a time in a loop, a closed connection never nests another run_forever()
+        while Linker._keep_running:
+            try:
+                Linker._wsapp = websocket.WebSocketApp(Linker._url, on_open=Linker._on_open, on_close=Linker._on_close, on_message=Linker._on_message, on_error=Linker._on_error)
+                Linker._wsapp.run_forever()
+            except:
+                pass
+            Linker._connected.clear()
+            Linker._opened = False
+            if Linker._keep_running == False:
+                break
+            delay = Linker._get_backoff(Linker._attempts)
+            Linker._attempts += 1
+            if Linker._stopped.wait(delay):
+                break
+            Linker._reconnects += 1
 
     @staticmethod
     def _send_forever():
         target_time = timer()
         while Linker._keep_running and Linker._keep_send:
-            if Linker._opened:
-                if timer() > target_time:
-                    try:
-                        if Linker._wsapp is not None:
-                            links = Linker._links
-                            for key in links:
-                                link = links[key]
-                                if link is not None:
-                                    link.handle_motoring()
-                            str = json.dumps(Linker._packet)
-                            if Linker._wsapp is not None:
-                                Linker._wsapp.send(str)
-                    except:
-                        pass
-                    target_time += 0.02
-                    time.sleep(0.01)
-                time.sleep(0.001)
-            else:
-                time.sleep(0.01)
+            if Linker._connected.wait(0.1) == False:
+                target_time = timer()
+                continue
+            delay = target_time - timer()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                wsapp = Linker._wsapp
+                if wsapp is not None:
+                    links = Linker._links
+                    for key in links:
+                        link = links[key]
+                        if link is not None:
+                            link.handle_motoring()
+                    data = Linker._encode()
+                    if data is not None:
+                        if isinstance(data, bytes):
+                            wsapp.send(data, websocket.ABNF.OPCODE_BINARY)
+                        else:
+                            wsapp.send(data)
+            except:
+                pass
+            target_time += 0.02
+            # Don't try to catch up on ticks missed while stalled
+            if timer() - target_time > 0.1:
+                target_time = timer()
 
     @staticmethod
     def start(url):
@@ -164,10 +382,15 @@ class Linker(object):
             Linker._start_flag = True
             Linker._url = url
             Linker._keep_running = True
+            Linker._stopped.clear()
             thread = threading.Thread(target=Linker._open)
             Linker._recv_thread = thread
             thread.daemon = True
             thread.start()
+            thread = threading.Thread(target=Linker._decode_forever)
+            Linker._decode_thread = thread
+            thread.daemon = True
+            thread.start()
             Linker._keep_send = True
             thread = threading.Thread(target=Linker._send_forever)
             Linker._send_thread = thread
@@ -180,6 +403,13 @@ class Linker(object):
             Linker._start_flag = False
             Linker._keep_send = False
             Linker._keep_running = False
+            Linker._stopped.set()
+            wsapp = Linker._wsapp
+            if wsapp:
+                try:
+                    wsapp.close()
+                except:
+                    pass
             thread = Linker._send_thread
             Linker._send_thread = None
             if thread:
@@ -188,8 +418,11 @@ class Linker(object):
             Linker._recv_thread = None
             if thread:
                 thread.join()
-            if Linker._wsapp:
-                Linker._wsapp.teardown()
+            thread = Linker._decode_thread
+            Linker._decode_thread = None
+            if thread:
+                thread.join()
+            Linker._wsapp = None
 
     @staticmethod
     def print_message(tag, message):
@@ -0,0 +1,145 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+from concurrent.futures import Future
+
+from neopia.model import Batch
+
+
+TICK_MS = 20.0
+
+
+class Melody(object):
+    def __init__(self, events, length, loop=False):
+        # events is a list of (tick offset, note value) sorted by offset, length is in ticks
+        self._events = events
+        self._length = length
+        self._loop = loop
+        self._future = Future()
+        self._stopped = False
+        self._start_tick = -1
+        self._loops = 0
+
+    def get_length(self):
+        return self._length
+
+    def get_start_tick(self):
+        return self._start_tick
+
+    def get_loops(self):
+        return self._loops
+
+    def get_future(self):
+        return self._future
+
+    def is_playing(self):
+        return self._future.done() == False
+
+    def stop(self):
+        self._stopped = True
+
+    def wait(self, timeout=None):
+        Batch.check_closed()
+        return self._future.result(timeout)
+
+
+def compile_melody(notes, tail_ms=100, tick_ms=TICK_MS):
+    # notes is a sequence of (note value, duration ms). A note is released tail_ms before its end
+    # as Neosoco.buzzer() does, start times are accumulated in ms so rounding never drifts.
+    # Offsets are in ticks of tick_ms, the period of the runtime that plays the melody.
+    events = []
+    position = 0.0
+    for value, duration in notes:
+        start = int(round(position / tick_ms))
+        events.append((start, value))
+        if value != 0 and duration > tail_ms:
+            release = int(round((position + duration - tail_ms) / tick_ms))
+            if release > start:
+                events.append((release, 0))
+        position += duration
+    length = int(round(position / tick_ms))
+    # When two events fall on the same tick, the later one wins
+    merged = []
+    for offset, value in events:
+        if len(merged) > 0 and merged[-1][0] == offset:
+            merged[-1] = (offset, value)
+        else:
+            merged.append((offset, value))
+    return merged, length
+
+
+class MelodyPlayer(object):
+    def __init__(self, robot, device_id):
+        self._robot = robot
+        self._device_id = device_id
+        self._melody = None
+        self._index = 0
+
+    def play(self, melody):
+        current = self._melody
+        self._melody = melody
+        if current is not None and current._future.done() == False:
+            current.stop()
+            try:
+                current._future.set_result(False)
+            except:
+                pass
+        return melody
+
+    def stop(self):
+        melody = self._melody
+        if melody is not None:
+            melody.stop()
+
+    def _finish(self, melody, result):
+        if self._melody is melody:
+            self._melody = None
+        self._robot.write(self._device_id, 0)
+        if melody._future.done() == False:
+            try:
+                melody._future.set_result(result)
+            except:
+                pass
+
+    def _tick(self, tick):
+        melody = self._melody
+        if melody is None:
+            return
+        if melody._stopped:
+            self._finish(melody, False)
+            return
+        if melody._start_tick < 0:
+            melody._start_tick = tick
+            self._index = 0
+        events = melody._events
+        while True:
+            offset = tick - melody._start_tick
+            index = self._index
+            while index < len(events) and events[index][0] <= offset:
+                self._robot.write(self._device_id, events[index][1])
+                index += 1
+            self._index = index
+            if offset < melody._length:
+                return
+            if melody._loop == False or melody._length <= 0:
+                self._finish(melody, True)
+                return
+            # Start the next loop on the very tick the previous one ends
+            melody._start_tick += melody._length
+            melody._loops += 1
+            self._index = 0
@@ -38,6 +38,8 @@ class Mode(object):
         return Mode._mode == Mode._LINK_MODE
 
     @staticmethod
-    def set_link_mode(url):
+    def set_link_mode(url, delta=False, binary=False):
         Mode._mode = Mode._LINK_MODE
+        Linker.set_delta_encoding(delta)
+        Linker.set_binary_framing(binary)
         Linker.start(url)
\ No newline at end of file
@@ -16,13 +16,54 @@
 # Free Software Foundation, Inc., 59 Temple Place, Suite 330,
 # Boston, MA  02111-1307  USA
 
+import fnmatch
+import threading
 from functools import reduce
 
+from neopia.dispatcher import Dispatcher
+from neopia.dispatcher import OverflowPolicy
+from neopia.dispatcher import DEFAULT_CAPACITY
+from neopia.invoker import unwrap
+from neopia.invoker import report_error
+
 
 DeviceType = type("Enum", (), {"SENSOR": 0, "EFFECTOR": 1, "EVENT": 2, "COMMAND": 3})
 DataType = type("Enum", (), {"INTEGER": 4, "FLOAT": 5, "STRING": 6})
 
 
+def _merge_device_index(owner, neobot):
+    # Qualify the devices the sub-neobot already has with its name
+    prefix = neobot.get_name().lower() + "."
+    for name, device in neobot._devices_by_name.items():
+        owner._index_device(prefix + name, (), device)
+    for device_id, device in neobot._devices_by_id.items():
+        owner._index_device(None, (device_id,), device)
+
+
+def _subscribe(owner, listener, ids, names, dead_band, capacity, policy):
+    subscription = DeviceSubscription(listener, dead_band, capacity, policy)
+    if ids is None and names is None:
+        devices = owner._devices_by_id.values()
+    else:
+        devices = []
+        if ids is not None:
+            if isinstance(ids, int): ids = (ids,)
+            for device_id in ids:
+                device = owner._devices_by_id.get(device_id)
+                if device is not None:
+                    devices.append(device)
+        if names is not None:
+            if isinstance(names, str): names = (names,)
+            for pattern in names:
+                pattern = str(pattern).lower()
+                for name, device in owner._devices_by_name.items():
+                    if fnmatch.fnmatchcase(name, pattern):
+                        devices.append(device)
+    for device in devices:
+        subscription._attach(device)
+    return subscription
+
+
 class NamedElement(object):
     def __init__(self, name):
         self.set_name(name)
@@ -52,7 +93,16 @@ class Device(NamedElement):
         self._fired = False
         self._written = False
         self._can_notify = False
+        self._changed = False
         self._device_data_changed_listeners = []
+        self._listener_queues = []
+        self._subscriptions = []
+        self._history = None
+        # Writing the value a device already has is skipped, except for commands where re-sending matters
+        self._suppress_unchanged = device_type == DeviceType.EFFECTOR
+        self._suppressed = 0
+        # Guards the data and the flags, they're written by user threads and the I/O thread and cleared by the Runner
+        self._lock = threading.Lock()
 
     def get_id(self):
         return self._id
@@ -69,8 +119,31 @@ class Device(NamedElement):
     def _is_written(self):
         return self._written
 
+    def _take_written(self):
+        with self._lock:
+            written = self._written
+            self._written = False
+            return written
+
+    def is_suppressing_unchanged(self):
+        return self._suppress_unchanged
+
+    def set_suppress_unchanged(self, suppress):
+        if self._device_type == DeviceType.SENSOR or self._device_type == DeviceType.EVENT:
+            return False
+        self._suppress_unchanged = bool(suppress)
+        return True
+
+    def get_suppressed_count(self):
+        return self._suppressed
+
+    def reset_suppressed_count(self):
+        with self._lock:
+            self._suppressed = 0
+
     def _clear_written(self):
-        self._written = False
+        with self._lock:
+            self._written = False
 
     def _check_data_type(self, value):
         if self._data_type == DataType.INTEGER or self._data_type == DataType.FLOAT:
@@ -113,6 +186,10 @@ class Device(NamedElement):
             return 0
 
     def write(self, arg1=None, arg2=None):
+        with self._lock:
+            return self._write(arg1, arg2)
+
+    def _write(self, arg1, arg2):
         this_data = self._data
         if arg1 is None:
             self._fired = True
@@ -124,6 +201,9 @@ class Device(NamedElement):
             index = int(arg1)
             if index < 0:
                 return False
+            if self._suppress_unchanged and index < len(this_data) and this_data[index] == arg2:
+                self._suppressed += 1
+                return True
             if self._check_data_type(arg2) == False:
                 return False
             this_len = len(this_data)
@@ -134,12 +214,22 @@ class Device(NamedElement):
                     this_data = self._data = new_data
                 else:
                     return False
-            this_data[index] = self._check_range(arg2)
+            value = self._check_range(arg2)
+            if this_data[index] != value:
+                this_data[index] = value
+                self._changed = True
+            elif self._suppress_unchanged:
+                self._suppressed += 1
+                return True
             self._fired = True
             self._written = True
             self._can_notify = True
             return True
         elif isinstance(arg1, (int, float, str)):
+            if self._suppress_unchanged and len(this_data) > 0 and this_data[0] == arg1:
+                # The stored value is already checked and clamped, so an equal one needs no checks
+                self._suppressed += 1
+                return True
             if self._device_type == DeviceType.SENSOR or self._device_type == DeviceType.EVENT:
                 return False
             if self._check_data_type(arg1) == False:
@@ -149,7 +239,13 @@ class Device(NamedElement):
                     this_data = self._data = [0]
                 else:
                     return False
-            this_data[0] = self._check_range(arg1)
+            value = self._check_range(arg1)
+            if this_data[0] != value:
+                this_data[0] = value
+                self._changed = True
+            elif self._suppress_unchanged:
+                self._suppressed += 1
+                return True
             self._fired = True
             self._written = True
             self._can_notify = True
@@ -167,10 +263,16 @@ class Device(NamedElement):
             if this_len <= 0:
                 return 0
             length = min(this_len, data_len)
+            if self._suppress_unchanged and list(this_data[:length]) == list(arg1[:length]):
+                self._suppressed += 1
+                return length
             written = False
             for i in range(length):
                 if self._check_data_type(arg1[i]):
-                    this_data[i] = self._check_range(arg1[i])
+                    value = self._check_range(arg1[i])
+                    if this_data[i] != value:
+                        this_data[i] = value
+                        self._changed = True
                     self._fired = True
                     self._written = True
                     self._can_notify = True
@@ -179,60 +281,200 @@ class Device(NamedElement):
                 return length
         return 0
 
+    def _write_value(self, value):
+        # Fast path for callers that have already checked and clamped the value
+        with self._lock:
+            data = self._data
+            if data[0] != value:
+                data[0] = value
+                self._changed = True
+            elif self._suppress_unchanged:
+                self._suppressed += 1
+                return
+            self._fired = True
+            self._written = True
+            self._can_notify = True
+
     def _put(self, value, fired=True):
-        self._data[0] = value
-        self._fired = fired
-        self._can_notify = True
+        data = self._data
+        if data[0] != value:
+            with self._lock:
+                data = self._data
+                data[0] = value
+                self._changed = True
+                self._fired = fired
+                self._can_notify = True
+        else:
+            # Only the flags are set for an unchanged value, single stores that need no lock
+            self._fired = fired
+            self._can_notify = True
+        history = self._history
+        if history is not None:
+            history.append(value)
 
     def _put_at(self, index, value, fired=True):
-        self._data[index] = value
-        self._fired = fired
-        self._can_notify = True
+        data = self._data
+        if data[index] != value:
+            with self._lock:
+                data = self._data
+                data[index] = value
+                self._changed = True
+                self._fired = fired
+                self._can_notify = True
+        else:
+            self._fired = fired
+            self._can_notify = True
 
     def _put_empty(self, fired=True):
-        self._fired = fired
-        self._can_notify = True
+        # An event carries no data, so every firing counts as a change
+        with self._lock:
+            self._fired = fired
+            self._changed = fired
+            self._can_notify = True
 
     def _reset(self):
-        self._event = False
-        self._fired = False
-        self._written = False
-        if self._data_size > 0:
-            self._data = [self._initial_value] * self._data_size
-        else:
-            self._data = []
+        with self._lock:
+            self._event = False
+            self._fired = False
+            self._written = False
+            if self._data_size > 0:
+                self._data = [self._initial_value] * self._data_size
+            else:
+                self._data = []
 
-    def add_device_data_changed_listener(self, listener):
+    def add_device_data_changed_listener(self, listener, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
         if listener:
-            self._device_data_changed_listeners.append(listener)
+            # Listeners are called by the dispatcher, never on the I/O or Runner thread
+            listener_queue = Dispatcher.get_default().get_queue(listener, unwrap(listener), capacity, policy)
+            with self._lock:
+                self._device_data_changed_listeners = self._device_data_changed_listeners + [listener]
+                self._listener_queues = self._listener_queues + [listener_queue]
 
     def remove_device_data_changed_listener(self, listener):
         if listener:
-            self._device_data_changed_listeners.remove(listener)
+            with self._lock:
+                listeners = list(self._device_data_changed_listeners)
+                listener_queues = list(self._listener_queues)
+                index = listeners.index(listener)
+                del listeners[index]
+                del listener_queues[index]
+                self._device_data_changed_listeners = listeners
+                self._listener_queues = listener_queues
+            # The queue is dropped when the listener is attached to no other device
+            Dispatcher.get_default().release(listener)
 
     def clear_device_data_changed_listeners(self):
-        self._device_data_changed_listeners = []
+        with self._lock:
+            listeners = self._device_data_changed_listeners
+            self._device_data_changed_listeners = []
+            self._listener_queues = []
+        dispatcher = Dispatcher.get_default()
+        for listener in listeners:
+            dispatcher.release(listener)
+
+    def enable_history(self, capacity=100):
+        from neopia.history import SensorHistory
+        history = self._history
+        if history is None or history.get_capacity() != capacity:
+            history = self._history = SensorHistory(capacity)
+        return history
+
+    def disable_history(self):
+        self._history = None
+
+    def get_history(self):
+        return self._history
+
+    def _add_subscription(self, subscription):
+        # Copy on write, the list is iterated by the I/O and Runner threads
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+
+    def _remove_subscription(self, subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
 
     def _update_device_state(self):
-        self._event = self._fired
-        self._fired = False
+        with self._lock:
+            self._event = self._fired
+            self._fired = False
 
     def _notify_device_data_changed(self):
-        if len(self._device_data_changed_listeners) > 0:
-            can_notify = True
-            if self._device_type == DeviceType.COMMAND or self._device_type == DeviceType.EVENT:
-                can_notify = self._can_notify
-            if can_notify:
-                data = tuple(self._data)
-                for listener in self._device_data_changed_listeners:
-                    try:
-                        listener.__func__(self, data)
-                    except:
-                        try:
-                            listener(self, data)
-                        except:
-                            pass
-        self._can_notify = False
+        # The lists are copy on write, so a device nobody listens to is done without taking the lock
+        listener_queues = self._listener_queues
+        subscriptions = self._subscriptions
+        if len(listener_queues) == 0 and len(subscriptions) == 0:
+            self._can_notify = False
+            self._changed = False
+            return
+        # Take the data and the flags together, deliver outside of the lock
+        with self._lock:
+            can_notify = self._can_notify
+            changed = self._changed
+            self._can_notify = False
+            self._changed = False
+            if len(listener_queues) > 0 and self._device_type != DeviceType.COMMAND and self._device_type != DeviceType.EVENT:
+                can_notify = True
+            notify = can_notify and len(listener_queues) > 0
+            deliver = changed and len(subscriptions) > 0
+            if notify == False and deliver == False:
+                return
+            data = tuple(self._data)
+        if notify:
+            args = (self, data)
+            for listener_queue in listener_queues:
+                listener_queue.put(self, args)
+        if deliver:
+            for subscription in subscriptions:
+                subscription._deliver(self, data)
+
+
+class DeviceSubscription(object):
+    def __init__(self, listener, dead_band=0, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
+        self._listener = listener
+        self._dead_band = dead_band
+        self._devices = []
+        self._last_data = {}
+        self._queue = Dispatcher.get_default().get_queue(self, unwrap(listener), capacity, policy)
+
+    def get_devices(self):
+        return list(self._devices)
+
+    def get_queue(self):
+        return self._queue
+
+    def _attach(self, device):
+        if device not in self._devices:
+            self._devices.append(device)
+            device._add_subscription(self)
+
+    def unsubscribe(self):
+        devices = self._devices
+        self._devices = []
+        for device in devices:
+            device._remove_subscription(self)
+        Dispatcher.get_default().release(self)
+
+    def _is_within_dead_band(self, last_data, data):
+        if len(last_data) != len(data):
+            return False
+        dead_band = self._dead_band
+        for last, value in zip(last_data, data):
+            if isinstance(value, str) or isinstance(last, str):
+                if value != last:
+                    return False
+            elif abs(value - last) >= dead_band:
+                return False
+        return True
+
+    def _deliver(self, device, data):
+        if self._dead_band > 0:
+            # Compare with the last delivered value so that a slow drift is reported eventually
+            last_data = self._last_data.get(device)
+            if last_data is not None and self._is_within_dead_band(last_data, data):
+                return
+            self._last_data[device] = data
+        self._queue.put(device, (device, data))
 
 
 class Neobot(NamedElement):
@@ -244,6 +486,9 @@ class Neobot(NamedElement):
         self._devices = []
         self._sensory_devices = []
         self._motoring_devices = []
+        self._devices_by_name = {}
+        self._devices_by_id = {}
+        self._parent = None
         self._disposed = False
 
     def _is_disposed(self):
@@ -266,11 +511,25 @@ class Neobot(NamedElement):
             self._sensory_devices.append(dev)
         else:
             self._motoring_devices.append(dev)
+        self._index_device(name.lower(), (id, dev.get_id()), dev)
         return dev
 
     def _add_neobot(self, neobot):
         if isinstance(neobot, Neobot):
             self._neobots.append(neobot)
+            neobot._parent = self
+            _merge_device_index(self, neobot)
+
+    def _index_device(self, name, ids, device):
+        # The first device registered under a name or an id wins, as the linear search did
+        if name is not None:
+            self._devices_by_name.setdefault(name, device)
+            name = self.get_name().lower() + "." + name
+        for device_id in ids:
+            self._devices_by_id.setdefault(device_id, device)
+        parent = self._parent
+        if parent is not None:
+            parent._index_device(name, ids, device)
 
     def get_id(self):
         return self._id
@@ -291,40 +550,17 @@ class Neobot(NamedElement):
         return None
 
     def find_device_by_name(self, name):
-        name = str(name).lower()
-        dot = name.find(".")
-        if dot < 0:
-            for device in self._devices:
-                if name == device.get_name().lower():
-                    return device
-        else:
-            neobot_name = name[:dot]
-            sub_name = name[dot+1:]
-            for neobot in self._neobots:
-                if neobot_name == neobot.get_name().lower():
-                    return neobot.find_device_by_name(sub_name)
-        return None
+        return self._devices_by_name.get(str(name).lower())
 
     def find_device_by_id(self, device_id):
-        uid = device_id & 0xfffff000
-        if uid == self._uid:
-            for device in self._devices:
-                if device.get_id() == device_id:
-                    return device
-            return None
+        return self._devices_by_id.get(device_id)
 
-        for neobot in self._neobots:
-            device = neobot.find_device_by_id(device_id)
-            if device is not None:
-                return device
-        return None
-
-    def add_device_data_changed_listener(self, listener):
+    def add_device_data_changed_listener(self, listener, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
         if listener:
             for device in self._devices:
-                device.add_device_data_changed_listener(listener)
+                device.add_device_data_changed_listener(listener, capacity, policy)
             for neobot in self._neobots:
-                neobot.add_device_data_changed_listener(listener)
+                neobot.add_device_data_changed_listener(listener, capacity, policy)
 
     def remove_device_data_changed_listener(self, listener):
         if listener:
@@ -339,6 +575,9 @@ class Neobot(NamedElement):
         for neobot in self._neobots:
             neobot.clear_device_data_changed_listeners()
 
+    def subscribe(self, listener, ids=None, names=None, dead_band=0, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
+        return _subscribe(self, listener, ids, names, dead_band, capacity, policy)
+
     def _to_hex(self, number):
         value = int(number)
         if value < 0: value += 0x100
@@ -409,12 +648,47 @@ class Neobot(NamedElement):
             neobot._clear_written()
 
 
+# Batches open on each thread, waiting inside one would wait for writes that are captured only after it
+_open_batches = threading.local()
+
+
+class Batch(object):
+    # While any batch of a robot is open, its motoring data isn't captured, so all writes land in one packet
+    def __init__(self, robot):
+        self._robot = robot
+
+    def __enter__(self):
+        robot = self._robot
+        with robot._batch_lock:
+            robot._batch_depth += 1
+        _open_batches.depth = getattr(_open_batches, 'depth', 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _open_batches.depth -= 1
+        robot = self._robot
+        with robot._batch_lock:
+            robot._batch_depth -= 1
+        return False
+
+    @staticmethod
+    def check_closed():
+        if getattr(_open_batches, 'depth', 0) > 0:
+            raise RuntimeError('Cannot wait while a batch is open, its writes are sent only when it is closed')
+
+
 class Robot(NamedElement):
     def __init__(self, id, name, index):
         super(Robot, self).__init__(name)
         self._id = id
         self._index = index
         self._neobots = []
+        self._devices_by_name = {}
+        self._devices_by_id = {}
+        self._batch_lock = threading.Lock()
+        self._batch_depth = 0
+        self._motoring_count = 0
+        self._tick_tasks = []
 
     def dispose(self):
         for neobot in self._neobots:
@@ -433,6 +707,14 @@ class Robot(NamedElement):
     def _add_neobot(self, neobot):
         if isinstance(neobot, Neobot):
             self._neobots.append(neobot)
+            neobot._parent = self
+            _merge_device_index(self, neobot)
+
+    def _index_device(self, name, ids, device):
+        if name is not None:
+            self._devices_by_name.setdefault(name, device)
+        for device_id in ids:
+            self._devices_by_id.setdefault(device_id, device)
 
     def find_neobot_by_name(self, name):
         name = str(name).lower()
@@ -450,35 +732,23 @@ class Robot(NamedElement):
         return None
 
     def find_device_by_name(self, name):
-        name = str(name).lower()
-        dot = name.find(".")
-        if dot >= 0:
-            neobot_name = name[:dot]
-            sub_name = name[dot+1:]
-            for neobot in self._neobots:
-                if neobot_name == neobot.get_name().lower():
-                    return neobot.find_device_by_name(sub_name)
-        return None
+        return self._devices_by_name.get(str(name).lower())
 
     def find_device_by_id(self, device_id):
-        for neobot in self._neobots:
-            device = neobot.find_device_by_id(device_id)
-            if device is not None:
-                return device
-        return None
+        return self._devices_by_id.get(device_id)
 
     def e(self, device_id):
-        device = self.find_device_by_id(device_id)
+        device = self._devices_by_id.get(device_id)
         if device is None: return False
         return device.e()
 
     def read(self, device_id, arg=None):
-        device = self.find_device_by_id(device_id)
+        device = self._devices_by_id.get(device_id)
         if device is None: return 0
         return device.read(arg)
 
     def write(self, device_id, arg1, arg2=None):
-        device = self.find_device_by_id(device_id)
+        device = self._devices_by_id.get(device_id)
         if device is None:
             if isinstance(arg1, (int, float)) and isinstance(arg2, (int, float, str)):
                 return False
@@ -487,10 +757,31 @@ class Robot(NamedElement):
             return 0
         return device.write(arg1, arg2)
 
-    def add_device_data_changed_listener(self, listener):
+    def set_suppress_unchanged(self, device_id, suppress):
+        device = self._devices_by_id.get(device_id)
+        if device is None: return False
+        return device.set_suppress_unchanged(suppress)
+
+    def get_suppressed_count(self, device_id=None):
+        if device_id is not None:
+            device = self._devices_by_id.get(device_id)
+            if device is None: return 0
+            return device.get_suppressed_count()
+        devices = set(self._devices_by_id.values())
+        return sum(device.get_suppressed_count() for device in devices)
+
+    def batch(self):
+        return Batch(self)
+
+    def write_many(self, writes):
+        # writes is a sequence of (device_id, arg1) or (device_id, arg1, arg2)
+        with Batch(self):
+            return [self.write(*write) for write in writes]
+
+    def add_device_data_changed_listener(self, listener, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
         if listener:
             for neobot in self._neobots:
-                neobot.add_device_data_changed_listener(listener)
+                neobot.add_device_data_changed_listener(listener, capacity, policy)
 
     def remove_device_data_changed_listener(self, listener):
         if listener:
@@ -501,9 +792,33 @@ class Robot(NamedElement):
         for neobot in self._neobots:
             neobot.clear_device_data_changed_listeners()
 
+    def subscribe(self, listener, ids=None, names=None, dead_band=0, capacity=DEFAULT_CAPACITY, policy=OverflowPolicy.DROP_OLDEST):
+        return _subscribe(self, listener, ids, names, dead_band, capacity, policy)
+
     def _request_motoring_data(self):
-        for neobot in self._neobots:
-            neobot._request_motoring_data()
+        with self._batch_lock:
+            if self._batch_depth > 0:
+                return
+            for neobot in self._neobots:
+                neobot._request_motoring_data()
+            self._motoring_count += 1
+
+    def _add_tick_task(self, task):
+        # Copy on write, the list is iterated by the Runner thread
+        self._tick_tasks = self._tick_tasks + [task]
+
+    def _remove_tick_task(self, task):
+        self._tick_tasks = [t for t in self._tick_tasks if t is not task]
+
+    def _run_tick_tasks(self, tick):
+        for task in self._tick_tasks:
+            try:
+                task._tick(tick)
+            except Exception as e:
+                self._report_error(e, task)
+
+    def _report_error(self, error, source):
+        report_error(None, error, source)
 
     def _update_sensory_device_state(self):
         for neobot in self._neobots:
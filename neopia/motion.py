@@ -0,0 +1,164 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import threading
+from concurrent.futures import Future
+
+from neopia.model import Batch
+
+
+TICK_MS = 20.0
+
+
+def ms_to_ticks(milliseconds, tick_ms=TICK_MS):
+    return max(1, int(round(milliseconds / tick_ms)))
+
+
+class Motion(object):
+    def __init__(self, steps):
+        # steps is a list of (left motor, right motor, ticks)
+        self._steps = steps
+        self._future = Future()
+        self._stopped = False
+        self._brake = True
+        self._start_tick = -1
+        self._end_tick = -1
+
+    def get_start_tick(self):
+        return self._start_tick
+
+    def get_end_tick(self):
+        return self._end_tick
+
+    def get_future(self):
+        return self._future
+
+    def is_running(self):
+        return self._future.done() == False
+
+    def stop(self, brake=True):
+        self._brake = brake
+        self._stopped = True
+
+    def wait(self, timeout=None):
+        Batch.check_closed()
+        return self._future.result(timeout)
+
+
+class MotionTimeline(object):
+    def __init__(self, robot):
+        self._robot = robot
+        self._steps = []
+        # Durations are converted with the tick period of the robot's runtime
+        self._tick_ms = robot.get_runtime().get_period()
+
+    def drive(self, direction='forward', speed='60', duration_ms=1000):
+        left, right = self._robot._motor_values(direction, speed)
+        self._steps.append((left, right, ms_to_ticks(duration_ms, self._tick_ms)))
+        return self
+
+    def turn(self, direction='left', speed='60', duration_ms=500):
+        if not isinstance(direction, str) or not direction.lower() in ('left', 'right'):
+            raise ValueError('Wrong value of direction')
+        return self.drive(direction, speed, duration_ms)
+
+    def pause(self, duration_ms=500):
+        self._steps.append((0, 0, ms_to_ticks(duration_ms, self._tick_ms)))
+        return self
+
+    def start(self):
+        return self._robot._motion_player.play(Motion(list(self._steps)))
+
+
+class MotionPlayer(object):
+    def __init__(self, robot, left_id, right_id):
+        self._robot = robot
+        self._left_id = left_id
+        self._right_id = right_id
+        self._motion = None
+        self._step = 0
+        self._step_end = 0
+        self._last_tick = -1
+        # play() and stop() run on the caller's thread and _tick() on the Runner thread
+        self._lock = threading.Lock()
+
+    def play(self, motion):
+        with self._lock:
+            current = self._motion
+            self._motion = motion
+        if current is not None:
+            self._resolve(current, False)
+        return motion
+
+    def stop(self, brake=True):
+        # The caller takes the wheels over at once, no step of the motion is written after this returns
+        with self._lock:
+            motion = self._motion
+            if motion is None:
+                return
+            motion.stop(brake)
+            self._finish(motion, self._last_tick, brake)
+        self._resolve(motion, False)
+
+    def _resolve(self, motion, result):
+        # Futures are resolved outside of the lock, their callbacks may play another motion
+        if motion._future.done() == False:
+            try:
+                motion._future.set_result(result)
+            except:
+                pass
+
+    def _write(self, left, right):
+        self._robot.write_many(((self._left_id, left), (self._right_id, right)))
+
+    def _finish(self, motion, tick, brake=True):
+        self._motion = None
+        if brake:
+            self._write(0, 0)
+        motion._end_tick = tick
+
+    def _tick(self, tick):
+        with self._lock:
+            self._last_tick = tick
+            motion = self._motion
+            if motion is None:
+                return
+            result = self._advance(motion, tick)
+        if result is not None:
+            self._resolve(motion, result)
+
+    def _advance(self, motion, tick):
+        # Steps start and end on tick boundaries, and the Runner stops the wheels whatever the caller does
+        if motion._stopped:
+            self._finish(motion, tick, motion._brake)
+            return False
+        steps = motion._steps
+        if motion._start_tick < 0:
+            motion._start_tick = tick
+            self._step = -1
+            self._step_end = tick
+        while tick >= self._step_end:
+            step = self._step + 1
+            if step >= len(steps):
+                self._finish(motion, tick)
+                return True
+            left, right, ticks = steps[step]
+            self._step = step
+            self._step_end += ticks
+            self._write(left, right)
+        return None
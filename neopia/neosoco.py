@@ -17,11 +17,24 @@
 # Boston, MA  02111-1307  USA
 
 import math
+import time
+import threading
+from timeit import default_timer as timer
 
 from neopia.runner import Runner
 from neopia.util import Util
 from neopia.model import Robot
 from neopia.mode import Mode
+from neopia.sequencer import CommandSequencer
+from neopia.sequencer import all_of
+from neopia.melody import Melody
+from neopia.melody import MelodyPlayer
+from neopia.melody import compile_melody
+from neopia.motion import MotionTimeline
+from neopia.motion import MotionPlayer
+from neopia.port import InputPort
+from neopia.port import OutputPort
+from neopia.color import ColorClassifier
 
 
 class Neosoco(Robot):
@@ -196,6 +209,13 @@ class Neosoco(Robot):
         "b": _NOTE_B_1
     }
 
+    _BEATS_CVT = {
+        '2': 1,
+        '4': 0.5,
+        '8': 0.25,
+        '16': 0.125
+    }
+
     _MOTOR_PERCENT_CVT = { 
         '100': 15,
         '90': 14,
@@ -293,53 +313,188 @@ class Neosoco(Robot):
         '4': 13,
     }
     
+    _INPUT_PORTS = {
+        'in1': INPUT_1,
+        'in2': INPUT_2,
+        'in3': INPUT_3,
+        'remo': REMOCTL,
+        'bat': BATTERY
+    }
+
+    _OUTPUT_PORTS = {
+        'out1': OUTPUT_1,
+        'out2': OUTPUT_2,
+        'out3': OUTPUT_3
+    }
+
+    _SNAPSHOT_FIELDS = [
+        ('index', 'i4'),
+        ('in1', 'i4'),
+        ('in2', 'i4'),
+        ('in3', 'i4'),
+        ('remote', 'i4'),
+        ('battery', 'i4'),
+        ('timestamp', 'f8'),
+        ('sequence', 'i8')
+    ]
+
+    # Robots by index in each runtime
     _robots = {}
 
-    def __init__(self, index=0, port_name=None):
+    def __init__(self, index=0, port_name=None, runtime=None):
         if isinstance(index, str):
             index = 0
             port_name = index
-        if index in Neosoco._robots:
-            robot = Neosoco._robots[index]
+        if runtime is None:
+            runtime = Runner.get_default()
+        self._runtime = runtime
+        robots = Neosoco._robots.setdefault(runtime, {})
+        if index in robots:
+            robot = robots[index]
             if robot: robot.dispose()
-        Neosoco._robots[index] = self
+        robots[index] = self
         super(Neosoco, self).__init__(Neosoco.ID, "Neosoco", index)
         self._bpm = 60
+        self._sequencers = {}
+        for device_id in Neosoco._OUTPUT_PORTS.values():
+            sequencer = self._sequencers[device_id] = CommandSequencer(self, device_id)
+            self._add_tick_task(sequencer)
+        self._melody_player = MelodyPlayer(self, Neosoco.NOTE)
+        self._add_tick_task(self._melody_player)
+        self._motion_player = MotionPlayer(self, Neosoco.LEFT_MOTOR, Neosoco.RIGHT_MOTOR)
+        self._add_tick_task(self._motion_player)
+        self._input_ports = {}
+        self._output_ports = {}
+        self._classifiers = {}
         self._init(port_name)
 
     def dispose(self):
+        for sequencer in self._sequencers.values():
+            sequencer.cancel()
+        self._melody_player.stop()
+        self._motion_player.stop()
         # Lastly send init packet to stop all action in the controller
-        self.write(Neosoco.OUTPUT_1, 0) 
-        self.write(Neosoco.OUTPUT_2, 0) 
-        self.write(Neosoco.OUTPUT_3, 0)
-        self.write(Neosoco.LEFT_MOTOR, 0) 
-        self.write(Neosoco.RIGHT_MOTOR, 0) 
-        self.write(Neosoco.NOTE, 0)
-        Neosoco._robots[self.get_index()] = None
+        with self.batch():
+            self.write(Neosoco.OUTPUT_1, 0) 
+            self.write(Neosoco.OUTPUT_2, 0) 
+            self.write(Neosoco.OUTPUT_3, 0)
+            self.write(Neosoco.LEFT_MOTOR, 0) 
+            self.write(Neosoco.RIGHT_MOTOR, 0) 
+            self.write(Neosoco.NOTE, 0)
+        Neosoco._robots[self._runtime][self.get_index()] = None
         self._neobot._dispose()
-        Runner.unregister_robot(self)
+        self._runtime.unregister_robot(self)
+
+    def get_runtime(self):
+        return self._runtime
+
+    def _report_error(self, error, source):
+        self._runtime._report_error(error, source)
 
     def reset(self):
         self._bpm = 60
+        for sequencer in self._sequencers.values():
+            sequencer.cancel()
+        self._melody_player.stop()
+        self._motion_player.stop()
         self._neobot._reset()
 
     def _init(self, port_name):
         if Mode.is_link_mode():
             from neopia.neosoco_neobot import NeosocoLinkNeobot
-            self._neobot = NeosocoLinkNeobot(self.get_index())
+            self._neobot = NeosocoLinkNeobot(self.get_index(), self._runtime)
         else:
             from neopia.neosoco_neobot import NeosocoNeobot
-            self._neobot = NeosocoNeobot(self.get_index())
+            self._neobot = NeosocoNeobot(self.get_index(), self._runtime)
         self._add_neobot(self._neobot)
-        Runner.register_robot(self)
-        Runner.start()
-        self._neobot._init(port_name, Runner.get_robots())
+        runtime = self._runtime
+        runtime.register_robot(self)
+        runtime.start()
+        self._neobot._init(port_name, runtime.get_robots())
+
+    @staticmethod
+    def connect_all(indices, timeout=10.0, runtime=None):
+        # Connect the robots in parallel, it returns when all are ready or the deadline has passed.
+        # A robot that isn't ready by then is disposed, so it gives back its port, and is None in the result.
+        if isinstance(indices, int):
+            indices = range(indices)
+        indices = list(indices)
+        robots = {}
+        lock = threading.Lock()
+        expired = [False]
+
+        def connect(index):
+            robot = Neosoco(index, runtime=runtime)
+            with lock:
+                if expired[0] == False:
+                    robots[index] = robot
+                    return
+            # Still probing when the deadline passed, nobody has a handle to this robot
+            robot.dispose()
 
-    def find_device_by_id(self, device_id):
-        return self._neobot.find_device_by_id(device_id)
+        threads = []
+        for index in indices:
+            thread = threading.Thread(target=connect, args=(index,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        deadline = timer() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - timer()))
+        with lock:
+            expired[0] = True
+        result = []
+        for index in indices:
+            robot = robots.get(index)
+            if robot is not None and robot._neobot._ready:
+                result.append(robot)
+            else:
+                if robot is not None:
+                    robot.dispose()
+                result.append(None)
+        return result
+
+    @staticmethod
+    def _get_active_robots(runtime=None):
+        if runtime is None:
+            runtime = Runner.get_default()
+        robots = dict(Neosoco._robots.get(runtime, {}))
+        return [robots[index] for index in sorted(robots) if robots[index] is not None]
+
+    @staticmethod
+    def create_snapshot(size=None, runtime=None):
+        import numpy as np
+        if size is None:
+            size = len(Neosoco._get_active_robots(runtime))
+        return np.zeros(size, dtype=Neosoco._SNAPSHOT_FIELDS)
 
-    def _request_motoring_data(self):
-        self._neobot._request_motoring_data()
+    @staticmethod
+    def snapshot(out=None, runtime=None):
+        # Fill one row per robot with its latest sensory packet, rows are ordered by robot index
+        robots = Neosoco._get_active_robots(runtime)
+        if out is None:
+            out = Neosoco.create_snapshot(len(robots))
+        count = min(len(robots), len(out))
+        for i in range(count):
+            robot = robots[i]
+            neobot = robot._neobot
+            while True:
+                sequence = neobot._sequence
+                if sequence & 1:
+                    time.sleep(0)
+                    continue
+                row = (robot.get_index(),
+                       neobot._input_1_device._data[0],
+                       neobot._input_2_device._data[0],
+                       neobot._input_3_device._data[0],
+                       neobot._remoctl_device._data[0],
+                       neobot._battery_device._data[0],
+                       neobot._timestamp,
+                       sequence >> 1)
+                if neobot._sequence == sequence:
+                    break
+            out[i] = row
+        return out[:count]
 
     def _update_sensory_device_state(self):
         self._neobot._update_sensory_device_state()
@@ -357,19 +512,8 @@ class Neosoco(Robot):
         if isinstance(port, str) and isinstance(value, int):
             if value < 0 or value > 255:
                 raise ValueError('Wrong value of input value')
-                
-            if port.lower() =='out1':
-                self.write(Neosoco.OUTPUT_1, Util.round(value)) 
-            elif port.lower() =='out2':
-                self.write(Neosoco.OUTPUT_2, Util.round(value)) 
-            elif port.lower() =='out3':
-                self.write(Neosoco.OUTPUT_3, Util.round(value)) 
-            elif port.lower() =='all':
-                self.write(Neosoco.OUTPUT_1, Util.round(value)) 
-                self.write(Neosoco.OUTPUT_2, Util.round(value)) 
-                self.write(Neosoco.OUTPUT_3, Util.round(value))
-            else:
-                raise ValueError('Wrong value of port')
+            # Queued behind a sequence still playing on the port, like the other output writes
+            self._write_to_output_port(port, Util.round(value))
         else:
             raise TypeError
 
@@ -390,6 +534,49 @@ class Neosoco(Robot):
         else:
             raise TypeError
 
+    def _find_input_device(self, port):
+        if isinstance(port, str):
+            device_id = Neosoco._INPUT_PORTS.get(port.lower())
+            if device_id is None:
+                raise ValueError('Wrong value of port')
+            return self._devices_by_id.get(device_id)
+        else:
+            raise TypeError
+
+    def port(self, port='in1'):
+        # Resolve the port once, the handle reads straight from its device
+        if not isinstance(port, str):
+            raise TypeError
+        port = port.lower()
+        handle = self._input_ports.get(port)
+        if handle is None:
+            handle = InputPort(port, self._find_input_device(port))
+            self._input_ports[port] = handle
+        return handle
+
+    def out(self, port='out1'):
+        if not isinstance(port, str):
+            raise TypeError
+        port = port.lower()
+        handle = self._output_ports.get(port)
+        if handle is None:
+            device_id = Neosoco._OUTPUT_PORTS.get(port)
+            if device_id is None:
+                raise ValueError('Wrong value of out port')
+            handle = OutputPort(port, self._devices_by_id.get(device_id), self._sequencers[device_id])
+            self._output_ports[port] = handle
+        return handle
+
+    def enable_history(self, port='in1', capacity=100):
+        # Keep the last samples of the port, they're recorded on the I/O thread as packets arrive
+        return self._find_input_device(port).enable_history(capacity)
+
+    def disable_history(self, port='in1'):
+        self._find_input_device(port).disable_history()
+
+    def get_history(self, port='in1'):
+        return self._find_input_device(port).get_history()
+
     def get_angle(self, port='in1'):
         if isinstance(port, str):
             if port.lower() =='in1':
@@ -436,60 +623,93 @@ class Neosoco(Robot):
 
     def check_color(self, port='in1', color='white'):
         if isinstance(port and color, str):
-            if port.lower() =='in1':
-                c_value = self.read(Neosoco.INPUT_1)
-            elif port.lower() =='in2':
-                c_value = self.read(Neosoco.INPUT_2)
-            elif port.lower() =='in3':
-                c_value = self.read(Neosoco.INPUT_3)
-            else:
-                raise ValueError("Wrong value of port")
-
             if not color.lower() in Neosoco._COLORS.keys():
                 raise ValueError('Wrong value of color')
-            if (c_value >= 10 and c_value <= 50):
-                if (color.lower() == self.COLOR_NAME_WHITE): 
-                    return True
-                else: 
-                    return False
-            elif (c_value >= 51 and c_value <= 90):
-                if (color.lower() == self.COLOR_NAME_RED): 
-                    return True
-                else: 
-                    return False
-            elif (c_value >= 91 and c_value <= 130):
-                if (color.lower() == self.COLOR_NAME_YELLOW): 
-                    return True
-                else: 
-                    return False
-            elif (c_value >= 131 and c_value <= 170):
-                if (color.lower() == self.COLOR_NAME_GREEN): 
-                    return True
-                else: 
-                    return False
-            elif (c_value >= 171 and c_value <= 210):
-                if (color.lower() == self.COLOR_NAME_BLUE): 
-                    return True
-                else: 
-                    return False
-            else:
-                return False 
+            return self.classify(port) == color.lower()
         else:
             raise TypeError
 
-    def _write_to_output_port(self, port, out_val):
-        if port.lower() == 'out1':
-            self.write(Neosoco.OUTPUT_1, out_val)
-        elif port.lower() == 'out2':
-            self.write(Neosoco.OUTPUT_2, out_val)
-        elif port.lower() == 'out3':
-            self.write(Neosoco.OUTPUT_3, out_val)
-        elif port.lower() == 'all':
-            self.write(Neosoco.OUTPUT_1, out_val)
-            self.write(Neosoco.OUTPUT_2, out_val)
-            self.write(Neosoco.OUTPUT_3, out_val)
+    def get_color_classifier(self, port='in1'):
+        device_id = self._find_input_device(port).get_id()
+        classifier = self._classifiers.get(device_id)
+        if classifier is None:
+            classifier = self._classifiers[device_id] = ColorClassifier()
+        return classifier
+
+    def set_color_classifier(self, port='in1', classifier=None):
+        device_id = self._find_input_device(port).get_id()
+        if classifier is None:
+            self._classifiers.pop(device_id, None)
         else:
+            self._classifiers[device_id] = classifier
+
+    def classify(self, port='in1'):
+        # One table lookup per call, the table comes from the calibration of the port
+        device = self._find_input_device(port)
+        classifier = self._classifiers.get(device.get_id())
+        if classifier is None:
+            classifier = self.get_color_classifier(port)
+        return classifier.classify(device._data[0])
+
+    def classify_history(self, port='in1', n=None):
+        history = self.get_history(port)
+        if history is None:
+            raise ValueError('No history of port, call enable_history() first')
+        return self.get_color_classifier(port).classify_array(history.values(n))
+
+    def calibrate_color(self, port='in1', colors=None, samples=25, path=None, prompt=input):
+        # Place the sensor on each color when asked, the port's table is rebuilt from the readings
+        if colors is None:
+            colors = list(Neosoco._COLORS.keys())
+        device = self._find_input_device(port)
+        readings = {}
+        for color in colors:
+            if not color in Neosoco._COLORS.keys():
+                raise ValueError('Wrong value of color')
+            prompt('Put the sensor on %s and press Enter' % color)
+            values = []
+            for i in range(samples):
+                values.append(device._data[0])
+                time.sleep(0.02)
+            readings[color] = values
+        classifier = ColorClassifier.from_samples(readings)
+        self.set_color_classifier(port, classifier)
+        if path:
+            classifier.save(path)
+        return classifier
+
+    def load_color_calibration(self, path, port='in1'):
+        classifier = ColorClassifier.load(path)
+        self.set_color_classifier(port, classifier)
+        return classifier
+
+    def _sequence_to_output_port(self, port, values):
+        # Multi-step output protocols are played by the Runner, ports proceed concurrently
+        port = port.lower()
+        if port == 'all':
+            return all_of([self._sequencers[device_id].submit(values) for device_id in Neosoco._OUTPUT_PORTS.values()])
+        device_id = Neosoco._OUTPUT_PORTS.get(port)
+        if device_id is None:
             raise ValueError('Wrong value of out port')
+        return self._sequencers[device_id].submit(values)
+
+    def _write_to_output_port(self, port, out_val):
+        port = port.lower()
+        if port == 'all':
+            device_ids = Neosoco._OUTPUT_PORTS.values()
+        else:
+            device_id = Neosoco._OUTPUT_PORTS.get(port)
+            if device_id is None:
+                raise ValueError('Wrong value of out port')
+            device_ids = (device_id,)
+        with self.batch():
+            for device_id in device_ids:
+                sequencer = self._sequencers[device_id]
+                if sequencer.is_idle():
+                    self.write(device_id, out_val)
+                else:
+                    # Keep the call order while a sequence is still being played on the port
+                    sequencer.submit((out_val,), 0)
 
     def color_led_on(self, port='out1', red=255, blue=0, green=0):
         if isinstance(port, str):
@@ -501,24 +721,8 @@ class Neosoco(Robot):
                 blue = max(blue, 1)
                 blue = min(blue, 251)
 
-                # Red
-                self._write_to_output_port(port, 252)
-                Runner.wait(100)
-                self._write_to_output_port(port, red)
-                Runner.wait(100)
-                # Green
-                self._write_to_output_port(port, 253)
-                Runner.wait(100)
-                self._write_to_output_port(port, green)
-                Runner.wait(100)
-                # Blue
-                self._write_to_output_port(port, 254)
-                Runner.wait(100)
-                self._write_to_output_port(port, blue)
-                Runner.wait(100)
-                # Accept
-                self._write_to_output_port(port, 255)
-                Runner.wait(100)
+                # Red, green, blue and accept
+                return self._sequence_to_output_port(port, (252, red, 253, green, 254, blue, 255))
             else:
                 raise TypeError
         else:
@@ -562,36 +766,38 @@ class Neosoco(Robot):
 
     def motor_move(self, direction='forward'):
         if isinstance(direction, str):
+            self._motion_player.stop(False)
             speed = self._MOTOR_PERCENT_CVT['60']
             if direction.lower() =='forward':
-                self.write(Neosoco.LEFT_MOTOR, self._MOTOR_DIR['forward']+speed)
-                self.write(Neosoco.RIGHT_MOTOR, self._MOTOR_DIR['forward']+speed)
+                left = self._MOTOR_DIR['forward']+speed
+                right = self._MOTOR_DIR['forward']+speed
             elif direction.lower() =='backward':
-                self.write(Neosoco.LEFT_MOTOR, self._MOTOR_DIR['backward']+speed)
-                self.write(Neosoco.RIGHT_MOTOR, self._MOTOR_DIR['backward']+speed)
+                left = self._MOTOR_DIR['backward']+speed
+                right = self._MOTOR_DIR['backward']+speed
             elif direction.lower() =='left':
-                self.write(Neosoco.LEFT_MOTOR, self._MOTOR_DIR['backward']+speed)
-                self.write(Neosoco.RIGHT_MOTOR, self._MOTOR_DIR['forward']+speed)
+                left = self._MOTOR_DIR['backward']+speed
+                right = self._MOTOR_DIR['forward']+speed
             elif direction.lower() =='right':
-                self.write(Neosoco.LEFT_MOTOR, self._MOTOR_DIR['forward']+speed)
-                self.write(Neosoco.RIGHT_MOTOR, self._MOTOR_DIR['backward']+speed)
+                left = self._MOTOR_DIR['forward']+speed
+                right = self._MOTOR_DIR['backward']+speed
             elif direction.lower() =='stop':
-                self.write(Neosoco.LEFT_MOTOR, 0)
-                self.write(Neosoco.RIGHT_MOTOR, 0)
+                left = 0
+                right = 0
             else:
                 raise ValueError('Wrong value of direction')
+            self.write_many(((Neosoco.LEFT_MOTOR, left), (Neosoco.RIGHT_MOTOR, right)))
         else:
             raise TypeError
         
     def motor_stop(self, which_motor='both'):
         if isinstance(which_motor, str):
+            self._motion_player.stop(False)
             if which_motor.lower() =='right':
                 self.write(Neosoco.RIGHT_MOTOR, 0)
             elif which_motor.lower() =='left':
                 self.write(Neosoco.LEFT_MOTOR, 0)
             elif which_motor.lower() =='both':
-                self.write(Neosoco.LEFT_MOTOR, 0)
-                self.write(Neosoco.RIGHT_MOTOR, 0)
+                self.write_many(((Neosoco.LEFT_MOTOR, 0), (Neosoco.RIGHT_MOTOR, 0)))
             else:
                 raise ValueError('Wrong value of motor')
         else:
@@ -620,6 +826,7 @@ class Neosoco(Robot):
 
     def motor_rotate(self, motor='both', direction='forward', speed='100'):
         if isinstance(motor, str) and isinstance(direction, str) and isinstance(speed, str):
+            self._motion_player.stop(False)
             if speed == 'in1' or speed == 'in2' or speed == 'in3' :
                 speed = self._convert_scale_from_input_port(speed, 15)
             elif speed in self._MOTOR_PERCENT_CVT.keys():
@@ -643,8 +850,7 @@ class Neosoco(Robot):
                 raise ValueError('Wrong value of direction')
 
             if motor.lower() == 'both':
-                self.write(Neosoco.LEFT_MOTOR, l_direction + speed)
-                self.write(Neosoco.RIGHT_MOTOR, r_direction + speed)
+                self.write_many(((Neosoco.LEFT_MOTOR, l_direction + speed), (Neosoco.RIGHT_MOTOR, r_direction + speed)))
             elif motor.lower() == 'left':
                 self.write(Neosoco.LEFT_MOTOR, l_direction + speed)
             elif motor.lower() == 'right':
@@ -654,6 +860,41 @@ class Neosoco(Robot):
         else:
             raise TypeError
 
+    def _motor_values(self, direction, speed):
+        if isinstance(direction, str) and isinstance(speed, str):
+            if speed in self._MOTOR_PERCENT_CVT.keys():
+                speed = self._MOTOR_PERCENT_CVT[speed]
+            else:
+                raise ValueError('Wrong value of speed')
+
+            if direction.lower() =='forward':
+                return (self._MOTOR_DIR['forward'] + speed, self._MOTOR_DIR['forward'] + speed)
+            elif direction.lower() =='backward':
+                return (self._MOTOR_DIR['backward'] + speed, self._MOTOR_DIR['backward'] + speed)
+            elif direction.lower() =='left':
+                return (self._MOTOR_DIR['backward'] + speed, self._MOTOR_DIR['forward'] + speed)
+            elif direction.lower() =='right':
+                return (self._MOTOR_DIR['forward'] + speed, self._MOTOR_DIR['backward'] + speed)
+            elif direction.lower() =='stop':
+                return (0, 0)
+            else:
+                raise ValueError('Wrong value of direction')
+        else:
+            raise TypeError
+
+    def motion(self):
+        # Chain drive(), turn() and pause() and call start(), the Runner plays it on tick boundaries
+        return MotionTimeline(self)
+
+    def drive(self, direction='forward', speed='60', duration_ms=1000):
+        return self.motion().drive(direction, speed, duration_ms).start()
+
+    def turn_for(self, direction='left', speed='60', duration_ms=500):
+        return self.motion().turn(direction, speed, duration_ms).start()
+
+    def stop_motion(self):
+        self._motion_player.stop()
+
     def servo_rotate(self, port='out1', direction='forward', speed='100'):
         if isinstance(port, str) and isinstance(direction, str) and isinstance(speed, str):
             if speed == 'in1' or speed == 'in2' or speed == 'in3' :
@@ -683,10 +924,8 @@ class Neosoco(Robot):
 
     def servo_reset_degree(self, port='out1'):
         if isinstance(port, str):
-            self._write_to_output_port(port, self._SERVO_RESET_DEG)
-            Runner.wait(100)
-            self._write_to_output_port(port, 1) # Set where the motor is to 1 degree
-            Runner.wait(100)
+            # Set where the motor is to 1 degree
+            return self._sequence_to_output_port(port, (self._SERVO_RESET_DEG, 1))
         else:
             raise TypeError
 
@@ -728,12 +967,7 @@ class Neosoco(Robot):
             degree = min(degree, 180) # max of degree is 180
             degree = degree + 1
 
-            self._write_to_output_port(port, direction)
-            Runner.wait(100)
-            self._write_to_output_port(port, speed)
-            Runner.wait(100)
-            self._write_to_output_port(port, degree)
-            Runner.wait(100)
+            return self._sequence_to_output_port(port, (direction, speed, degree))
         else:
             raise TypeError
 
@@ -743,38 +977,52 @@ class Neosoco(Robot):
         else:
             raise TypeError
 
-    def buzzer(self, pitch='3', note='c', beats='4'):
-        self.write(Neosoco.NOTE, 0) # init
+    def _note_to_value(self, pitch, note):
         if not isinstance(pitch, str) or not (int(pitch) >= 1 and int(pitch) <= 6):
             raise ValueError('Wrong value of pitch')
-        if note != 0 and not note.lower() in Neosoco._NOTES.keys():
+        if note == 0:
+            return Neosoco._NOTE_OFF
+        if not note.lower() in Neosoco._NOTES.keys():
             raise ValueError('Wrong value of note')
-        else:
-            pitch = Neosoco._NOTES[note.lower()] + (int(pitch) - 1) * 12
-        if isinstance(pitch, (int, float)):
-            bpm_cvt = {
-                '2': 1,
-                '4': 0.5,
-                '8': 0.25,
-                '16': 0.125
-            }
-            if beats in bpm_cvt.keys():
+        return Neosoco._NOTES[note.lower()] + (int(pitch) - 1) * 12
+
+    def _beats_to_ms(self, beats, bpm=None):
+        if beats in Neosoco._BEATS_CVT.keys():
+            if bpm is None:
                 bpm = self._bpm # default 60
-                if note == 0:
-                    self.write(Neosoco.NOTE, Neosoco._NOTE_OFF)
-                    Runner.wait(bpm_cvt[beats] * 60 * 1000.0 / bpm)
-                else:
-                    timeout = bpm_cvt[beats] * 60 * 1000.0 / bpm
-                    tail = 0
-                    if timeout > 100:
-                        tail = 100
-                    self.write(Neosoco.NOTE, pitch)
-                    Runner.wait(timeout - tail)
-                    self.write(Neosoco.NOTE, Neosoco._NOTE_OFF)
-                    if tail > 0:
-                        Runner.wait(tail)
-            else:
-                raise ValueError('Wrong value of beats')
+            return Neosoco._BEATS_CVT[beats] * 60 * 1000.0 / bpm
+        else:
+            raise ValueError('Wrong value of beats')
+
+    def buzzer(self, pitch='3', note='c', beats='4'):
+        self.write(Neosoco.NOTE, 0) # init
+        value = self._note_to_value(pitch, note)
+        timeout = self._beats_to_ms(beats)
+        if value == Neosoco._NOTE_OFF:
+            self.write(Neosoco.NOTE, Neosoco._NOTE_OFF)
+            Runner.wait(timeout)
+        else:
+            tail = 0
+            if timeout > 100:
+                tail = 100
+            self.write(Neosoco.NOTE, value)
+            Runner.wait(timeout - tail)
+            self.write(Neosoco.NOTE, Neosoco._NOTE_OFF)
+            if tail > 0:
+                Runner.wait(tail)
+
+    def play_melody(self, notes, loop=False, bpm=None):
+        # notes is a sequence of (pitch, note, beats) as buzzer() takes them, a note of 0 is a rest.
+        # It returns at once, the melody is played by the Runner tick by tick.
+        compiled = []
+        for item in notes:
+            pitch, note, beats = item
+            compiled.append((self._note_to_value(pitch, note), self._beats_to_ms(beats, bpm)))
+        events, length = compile_melody(compiled, tick_ms=self._runtime.get_period())
+        return self._melody_player.play(Melody(events, length, loop))
+
+    def stop_melody(self):
+        self._melody_player.stop()
 
     def buzzer_by_port(self, port='in1'):
         if isinstance(port, str):
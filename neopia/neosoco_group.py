@@ -0,0 +1,134 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import time
+from concurrent.futures import Future
+from timeit import default_timer as timer
+
+from neopia.runner import Runner
+
+
+class GroupCommand(object):
+    def __init__(self, robots):
+        self._robots = robots
+        self._future = Future()
+        self._tick = -1
+
+    def get_tick(self):
+        return self._tick
+
+    def get_future(self):
+        return self._future
+
+    def wait(self, timeout=None):
+        # Results of each robot in the group order, an exception raised by a robot is returned in its place
+        return self._future.result(timeout)
+
+    def get_send_skew(self, timeout=1.0):
+        # Seconds between the first and the last serial port sending the packet of the command's tick
+        self._future.result(timeout)
+        deadline = timer() + timeout
+        while True:
+            times = []
+            for robot in self._robots:
+                sent = self._find_send_time(robot)
+                if sent is not None:
+                    times.append(sent)
+            if len(times) == len(self._robots):
+                return max(times) - min(times)
+            if timer() > deadline:
+                return None
+            time.sleep(0.005)
+
+    def _find_send_time(self, robot):
+        send_times = getattr(robot._neobot, '_send_times', None)
+        if send_times is None:
+            return None
+        for tick, sent in list(send_times):
+            if tick >= self._tick:
+                return sent
+        return None
+
+    def _apply(self, tick, method, args, kwargs):
+        self._tick = tick
+        results = []
+        for robot in self._robots:
+            try:
+                results.append(getattr(robot, method)(*args, **kwargs))
+            except Exception as e:
+                results.append(e)
+        self._future.set_result(results)
+
+
+class NeosocoGroup(object):
+    # Commands that return without waiting, so they can run on the Runner thread
+    _BROADCAST = (
+        'set_value',
+        'led_on',
+        'led_off',
+        'led_by_port',
+        'color_led_on',
+        'motor_move',
+        'motor_stop',
+        'motor_rotate',
+        'servo_rotate',
+        'servo_stop',
+        'servo_reset_degree',
+        'servo_rotate_by_degree',
+        'buzzer_by_port',
+        'buzzer_stop',
+        'play_melody',
+        'stop_melody',
+        'drive',
+        'turn_for',
+        'stop_motion'
+    )
+
+    def __init__(self, robots):
+        self._robots = tuple(robots)
+        # The robots are ticked together, so they must share a runtime
+        runtimes = set(getattr(robot, '_runtime', None) for robot in self._robots)
+        runtimes.discard(None)
+        if len(runtimes) > 1:
+            raise ValueError('Robots of different runtimes')
+        self._runtime = runtimes.pop() if runtimes else Runner.get_default()
+
+    def get_robots(self):
+        return self._robots
+
+    def __len__(self):
+        return len(self._robots)
+
+    def __iter__(self):
+        return iter(self._robots)
+
+    def broadcast(self, method, *args, **kwargs):
+        # All robots get the command on the same Runner tick, so it goes out in the same packet round
+        if not method in NeosocoGroup._BROADCAST:
+            raise ValueError('Wrong value of method')
+        command = GroupCommand(self._robots)
+        self._runtime.call_on_tick(lambda tick: command._apply(tick, method, args, kwargs))
+        return command
+
+    def get_values(self, port='in1'):
+        return [robot.get_value(port) for robot in self._robots]
+
+    def __getattr__(self, name):
+        if name in NeosocoGroup._BROADCAST:
+            return lambda *args, **kwargs: self.broadcast(name, *args, **kwargs)
+        raise AttributeError(name)
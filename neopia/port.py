@@ -0,0 +1,74 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+
+class InputPort(object):
+    def __init__(self, name, device):
+        self._name = name
+        self._device = device
+
+    def get_name(self):
+        return self._name
+
+    def get_device(self):
+        return self._device
+
+    def read(self):
+        return self._device._data[0]
+
+    @property
+    def value(self):
+        return self._device._data[0]
+
+    def get_history(self):
+        return self._device.get_history()
+
+
+class OutputPort(object):
+    def __init__(self, name, device, sequencer=None):
+        self._name = name
+        self._device = device
+        self._sequencer = sequencer
+        self._min_value = int(device._min_value)
+        self._max_value = int(device._max_value)
+
+    def get_name(self):
+        return self._name
+
+    def get_device(self):
+        return self._device
+
+    def read(self):
+        return self._device._data[0]
+
+    @property
+    def value(self):
+        return self._device._data[0]
+
+    def set(self, value):
+        value = int(value)
+        if value < self._min_value:
+            value = self._min_value
+        elif value > self._max_value:
+            value = self._max_value
+        sequencer = self._sequencer
+        if sequencer is not None and sequencer.is_idle() == False:
+            # Keep the call order while a sequence is still being played on the port
+            sequencer.submit((value,), 0)
+        else:
+            self._device._write_value(value)
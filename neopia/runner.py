@@ -18,101 +18,113 @@
 
 import threading
 import time
+import weakref
+from collections import deque
 from timeit import default_timer as timer
 
+from neopia.invoker import bind
+from neopia.invoker import unwrap
+from neopia.invoker import report_error
+from neopia.model import Batch
+
 
 class Evaluation(object):
     def __init__(self, evaluate, callback=None, event=False):
-        self._evaluate = evaluate
-        self._callback = callback
+        # Normalized once here, so checking a condition each tick is a plain call
+        self._evaluate = unwrap(evaluate)
+        self._callback = unwrap(callback)
         self._arg = None
+        self._evaluator = None
         self._event = event
         self._result = False
         self._result_prev = False
         self._done = False
         self._can_remove = callback is None
+        # The Runner sets the result, the callback thread resets it
+        self._lock = threading.Lock()
 
     def _set_arg(self, arg):
         self._arg = arg
+        self._evaluate = bind(self._evaluate, arg)
+        self._callback = bind(self._callback, arg)
 
     def _cancel(self):
         self._done = True
 
     def _check(self):
-        if self._evaluate:
+        evaluate = self._evaluate
+        if evaluate:
             result = False
             try:
-                if self._arg is not None:
-                    result = self._evaluate.__func__(self._arg)
-                else:
-                    result = self._evaluate.__func__()
-            except:
-                try:
-                    if self._arg is not None:
-                        result = self._evaluate(self._arg)
-                    else:
-                        result = self._evaluate()
-                except:
+                result = evaluate()
+            except Exception as e:
+                # The condition stays unless the error handler returns False
+                if self._evaluator._report_error(e, evaluate) == False:
                     self._evaluate = None
-            if self._event:
-                if result and self._result_prev == False:
-                    self._result = True
-                    self._done = True
+            with self._lock:
+                if self._event:
+                    if result and self._result_prev == False:
+                        self._result = True
+                        self._done = True
+                    else:
+                        self._result = False
+                    self._result_prev = result
                 else:
-                    self._result = False
-                self._result_prev = result
-            else:
-                self._result = result
-                if result:
-                    self._done = True
+                    self._result = result
+                    if result:
+                        self._done = True
 
-    def _run(self):
-        Runner._evaluator._add(self)
+    def _run(self, evaluator):
+        evaluator._add(self)
         while True:
             while self._result == False:
                 time.sleep(0.01)
-            if self._callback:
+            callback = self._callback
+            if callback:
                 try:
-                    if self._arg is not None:
-                        self._callback.__func__(self._arg)
-                    else:
-                        self._callback.__func__()
-                except:
-                    try:
-                        if self._arg is not None:
-                            self._callback(self._arg)
-                        else:
-                            self._callback()
-                    except:
+                    callback()
+                except Exception as e:
+                    if evaluator._report_error(e, callback) == False:
                         self._callback = None
-            self._result = False
-            self._done = False
+            with self._lock:
+                self._result = False
+                self._done = False
 
-    def _start(self):
-        thread = threading.Thread(target=self._run)
+    def _start(self, evaluator):
+        thread = threading.Thread(target=self._run, args=(evaluator,))
         thread.daemon = True
         thread.start()
 
 
 class Evaluator(object):
-    _added = []
-    _removed = []
-    _evaluations = []
-
-    @staticmethod
-    def _add(evaluation):
-        Evaluator._added.append(evaluation)
-
-    @staticmethod
-    def _evaluate():
-        added = Evaluator._added
-        removed = Evaluator._removed
-        evaluations = Evaluator._evaluations
+    def __init__(self, runtime=None):
+        self._runtime = runtime
+        self._added = []
+        self._removed = []
+        self._evaluations = []
+        self._lock = threading.Lock()
+
+    def _report_error(self, error, source):
+        if self._runtime is None:
+            return report_error(None, error, source)
+        return self._runtime._report_error(error, source)
+
+    def _add(self, evaluation):
+        evaluation._evaluator = self
+        with self._lock:
+            self._added.append(evaluation)
+
+    def _evaluate(self):
+        with self._lock:
+            added = self._added
+            if len(added) > 0:
+                self._added = []
+        removed = self._removed
+        evaluations = self._evaluations
 
         if len(added) > 0:
             for evaluation in added:
                 evaluations.append(evaluation)
-            Evaluator._added = []
         for evaluation in evaluations:
             if evaluation._done:
                 if evaluation._can_remove:
@@ -125,78 +137,276 @@ class Evaluator(object):
             for evaluation in removed:
                 if evaluation in evaluations:
                     evaluations.remove(evaluation)
-            Evaluator._removed = []
+            self._removed = []
+
+
+class Runtime(object):
+    # A scheduler of its own: robots, evaluator, tick period and thread.
+    # Runtimes don't share robots, a robot is ticked by the runtime it was created with.
+    _runtimes = weakref.WeakSet()
+
+    def __init__(self, name="Runtime", period_ms=20):
+        self._name = name
+        self._period = period_ms / 1000.0
+        self._added = []
+        self._removed = []
+        self._robots = []
+        self._components = []
+        self._thread = None
+        self._running = False
+        self._required = 0
+        self._checked = 0
+        self._start_flag = False
+        self._evaluator = Evaluator(self)
+        self._execute = None
+        self._error_handler = None
+        self._tick = 0
+        self._calls = deque()
+        self._ready_lock = threading.Lock()
+        self._robots_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        Runtime._runtimes.add(self)
+
+    def get_name(self):
+        return self._name
+
+    def get_period(self):
+        return self._period * 1000.0
+
+    def set_period(self, period_ms):
+        if period_ms <= 0:
+            raise ValueError('Wrong value of period')
+        self._period = period_ms / 1000.0
+
+    def dispose_all(self):
+        with self._robots_lock:
+            robots = self._robots
+            self._robots = []
+            components = self._components
+            self._components = []
+        for robot in robots:
+            robot.dispose()
+        for component in components:
+            component.dispose()
+
+    def shutdown(self):
+        self.dispose_all()
+
+        with self._start_lock:
+            self._running = False
+            thread = self._thread
+            self._thread = None
+            if thread:
+                thread.join()
+            self._start_flag = False
+
+    def register_robot(self, robot):
+        with self._robots_lock:
+            self._added.append(robot)
+
+    def get_robots(self):
+        # Copy on write, the list returned is never changed afterwards
+        return self._robots
+
+    def unregister_robot(self, robot):
+        with self._robots_lock:
+            self._removed.append(robot)
+
+    def register_component(self, component):
+        with self._robots_lock:
+            self._components = self._components + [component]
+
+    def unregister_component(self, component):
+        with self._robots_lock:
+            self._components = [c for c in self._components if c is not component]
+
+    def register_required(self):
+        with self._ready_lock:
+            self._required += 1
+
+    def register_checked(self):
+        with self._ready_lock:
+            self._checked += 1
+
+    def get_tick(self):
+        return self._tick
+
+    def call_on_tick(self, call):
+        # call(tick) runs once on the runtime thread before the robots' motoring data of that tick is captured
+        self._calls.append(call)
+
+    def set_executable(self, execute):
+        self._execute = unwrap(execute)
+
+    def set_error_handler(self, handler):
+        # handler(error, source) is told about a condition, callback, executable, tick call or tick task
+        # that raised. A condition, callback or executable is dropped only when the handler returns False.
+        # Without a handler the first traceback of each callable is written to stderr.
+        self._error_handler = handler
+
+    def _report_error(self, error, source):
+        return report_error(self._error_handler, error, source)
+
+    def wait_until_ready(self):
+        while self._checked < self._required:
+            time.sleep(0.01)
+
+    def wait_until(self, condition, arg=None):
+        Batch.check_closed()
+        evaluation = Evaluation(condition)
+        evaluation._set_arg(arg)
+        self._evaluator._add(evaluation)
+        self.start()
+        while evaluation._result == False:
+            time.sleep(0.01)
+
+    def when_do(self, condition, do, arg=None):
+        self.start()
+        evaluation = Evaluation(condition, do, True)
+        evaluation._set_arg(arg)
+        evaluation._start(self._evaluator)
+
+    def while_do(self, condition, do, arg=None):
+        self.start()
+        evaluation = Evaluation(condition, do)
+        evaluation._set_arg(arg)
+        evaluation._start(self._evaluator)
+
+    def _run(self):
+        try:
+            target_time = timer()
+            while self._running:
+                if timer() > target_time:
+                    with self._robots_lock:
+                        added = self._added
+                        removed = self._removed
+                        if len(added) > 0 or len(removed) > 0:
+                            robots = self._robots + added
+                            robots = [robot for robot in robots if not robot in removed]
+                            self._robots = robots
+                            self._added = []
+                            self._removed = []
+                        robots = self._robots
+
+                    for robot in robots:
+                        robot._update_sensory_device_state()
+
+                    self._evaluator._evaluate()
+
+                    execute = self._execute
+                    if execute:
+                        try:
+                            execute()
+                        except Exception as e:
+                            if self._report_error(e, execute) == False:
+                                self._execute = None
+
+                    tick = self._tick
+                    calls = self._calls
+                    while len(calls) > 0:
+                        call = calls.popleft()
+                        try:
+                            call(tick)
+                        except Exception as e:
+                            self._report_error(e, call)
+                    for robot in robots:
+                        robot._run_tick_tasks(tick)
+                    for robot in robots:
+                        robot._request_motoring_data()
+                    for robot in robots:
+                        robot._update_motoring_device_state()
+                    for robot in robots:
+                        robot._notify_motoring_device_data_changed()
+
+                    self._tick = tick + 1
+                    period = self._period
+                    target_time += period
+                    time.sleep(period / 2)
+                time.sleep(0.001)
+        except:
+            pass
+
+    def start(self):
+        # Robots connected in parallel all start their runtime, only one thread may tick it
+        with self._start_lock:
+            if self._start_flag == False:
+                self._start_flag = True
+                self._running = True
+                thread = threading.Thread(target=self._run)
+                thread.name = self._name
+                self._thread = thread
+                thread.daemon = True
+                thread.start()
 
 
 class Runner(object):
-    _added = []
-    _removed = []
-    _robots = []
-    _components = []
-    _thread = None
-    _required = 0
-    _checked = 0
-    _start_flag = False
-    _evaluator = Evaluator()
-    _execute = None
+    # The default runtime, used by robots created without one and by the top-level functions
+    _default = Runtime("Runner")
+
+    @staticmethod
+    def get_default():
+        return Runner._default
 
     @staticmethod
     def dispose_all():
-        robots = Runner._robots
-        Runner._robots = []
-        for robot in robots:
-            robot.dispose()
-        components = Runner._components
-        Runner._components = []
-        for component in components:
-            component.dispose()
+        Runner._default.dispose_all()
 
     @staticmethod
     def shutdown():
-        Runner.dispose_all()
+        Runner._default.shutdown()
 
-        Runner._running = False
-        thread = Runner._thread
-        Runner._thread = None
-        if thread:
-            thread.join()
+    @staticmethod
+    def shutdown_all():
+        for runtime in list(Runtime._runtimes):
+            runtime.shutdown()
 
     @staticmethod
     def register_robot(robot):
-        Runner._added.append(robot)
+        Runner._default.register_robot(robot)
 
     @staticmethod
     def get_robots():
-        return Runner._robots
+        return Runner._default.get_robots()
 
     @staticmethod
     def unregister_robot(robot):
-        Runner._removed.append(robot)
+        Runner._default.unregister_robot(robot)
 
     @staticmethod
     def register_component(component):
-        Runner._components.append(component)
+        Runner._default.register_component(component)
 
     @staticmethod
     def unregister_component(component):
-        components = Runner._components
-        if component in components:
-            components.remove(component)
+        Runner._default.unregister_component(component)
 
     @staticmethod
     def register_required():
-        Runner._required += 1
+        Runner._default.register_required()
 
     @staticmethod
     def register_checked():
-        Runner._checked += 1
+        Runner._default.register_checked()
+
+    @staticmethod
+    def get_tick():
+        return Runner._default.get_tick()
+
+    @staticmethod
+    def call_on_tick(call):
+        Runner._default.call_on_tick(call)
 
     @staticmethod
     def set_executable(execute):
-        Runner._execute = execute
+        Runner._default.set_executable(execute)
+
+    @staticmethod
+    def set_error_handler(handler):
+        Runner._default.set_error_handler(handler)
 
     @staticmethod
     def wait(milliseconds):
+        Batch.check_closed()
         current = timer()
         if isinstance(milliseconds, (int, float)):
             if milliseconds > 0:
@@ -209,31 +419,19 @@ class Runner(object):
 
     @staticmethod
     def wait_until_ready():
-        while Runner._checked < Runner._required:
-            time.sleep(0.01)
+        Runner._default.wait_until_ready()
 
     @staticmethod
     def wait_until(condition, arg=None):
-        evaluation = Evaluation(condition)
-        evaluation._set_arg(arg)
-        Runner._evaluator._add(evaluation)
-        Runner.start()
-        while evaluation._result == False:
-            time.sleep(0.01)
+        Runner._default.wait_until(condition, arg)
 
     @staticmethod
     def when_do(condition, do, arg=None):
-        Runner.start()
-        evaluation = Evaluation(condition, do, True)
-        evaluation._set_arg(arg)
-        evaluation._start()
+        Runner._default.when_do(condition, do, arg)
 
     @staticmethod
     def while_do(condition, do, arg=None):
-        Runner.start()
-        evaluation = Evaluation(condition, do)
-        evaluation._set_arg(arg)
-        evaluation._start()
+        Runner._default.while_do(condition, do, arg)
 
     @staticmethod
     def parallel(functions):
@@ -242,59 +440,6 @@ class Runner(object):
             thread.daemon = True
             thread.start()
 
-    @staticmethod
-    def _run():
-        try:
-            target_time = timer()
-            while Runner._running:
-                if timer() > target_time:
-                    added = Runner._added
-                    removed = Runner._removed
-                    robots = Runner._robots
-
-                    if len(added) > 0:
-                        for robot in added:
-                            robots.append(robot)
-                        Runner._added = []
-                    if len(removed) > 0:
-                        for robot in removed:
-                            if robot in robots:
-                                robots.remove(robot)
-                        Runner._removed = []
-
-                    for robot in robots:
-                        robot._update_sensory_device_state()
-
-                    Runner._evaluator._evaluate()
-
-                    if Runner._execute:
-                        try:
-                            Runner._execute.__func__()
-                        except:
-                            try:
-                                Runner._execute()
-                            except:
-                                Runner._execute = None
-
-                    for robot in robots:
-                        robot._request_motoring_data()
-                    for robot in robots:
-                        robot._update_motoring_device_state()
-                    for robot in robots:
-                        robot._notify_motoring_device_data_changed()
-
-                    target_time += 0.02
-                    time.sleep(0.01)
-                time.sleep(0.001)
-        except:
-            pass
-
     @staticmethod
     def start():
-        if Runner._start_flag == False:
-            Runner._start_flag = True
-            Runner._running = True
-            thread = threading.Thread(target=Runner._run)
-            Runner._thread = thread
-            thread.daemon = True
-            thread.start()
\ No newline at end of file
+        Runner._default.start()
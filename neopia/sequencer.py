@@ -0,0 +1,147 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import math
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from neopia.model import Batch
+
+
+# Milliseconds a step is held after it went out, the controller needs 100 ms per step
+DEFAULT_HOLD_MS = 100
+
+
+class CommandFuture(Future):
+    # A sequence proceeds only as its steps are captured, which never happens inside a batch
+    def result(self, timeout=None):
+        Batch.check_closed()
+        return super(CommandFuture, self).result(timeout)
+
+
+def all_of(futures):
+    combined = CommandFuture()
+    futures = list(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        combined.set_result(True)
+
+    if len(futures) == 0:
+        combined.set_result(True)
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+class CommandSequencer(object):
+    def __init__(self, robot, device_id, hold_ms=DEFAULT_HOLD_MS):
+        self._robot = robot
+        self._device_id = device_id
+        self._hold_ms = hold_ms
+        self._pending = deque()
+        self._current = None
+        self._step = 0
+        self._remaining = 0
+        self._written_count = -1
+        # cancel() runs on the caller's thread and _tick() on the Runner thread
+        self._lock = threading.Lock()
+
+    def is_idle(self):
+        return self._current is None and len(self._pending) == 0
+
+    def submit(self, values, hold_ms=None):
+        if hold_ms is None:
+            hold_ms = self._hold_ms
+        # Rounded up, a step is never held shorter than asked whatever the tick period of the runtime
+        hold_ticks = 0
+        if hold_ms > 0:
+            hold_ticks = int(math.ceil(hold_ms / self._robot.get_runtime().get_period()))
+        future = CommandFuture()
+        with self._lock:
+            self._pending.append((tuple(values), hold_ticks, future))
+        return future
+
+    def cancel(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = deque()
+            current = self._current
+            self._current = None
+        for item in pending:
+            item[2].cancel()
+        if current is not None:
+            self._resolve(current[2], False)
+
+    def _resolve(self, future, result):
+        # Futures are resolved outside of the lock, their callbacks may submit or cancel
+        if future.done() == False:
+            try:
+                future.set_result(result)
+            except:
+                pass
+
+    def _next(self):
+        pending = self._pending
+        while len(pending) > 0:
+            current = pending.popleft()
+            if current[2].set_running_or_notify_cancel():
+                self._current = current
+                self._step = 0
+                return current
+        return None
+
+    def _tick(self, tick):
+        done = []
+        with self._lock:
+            self._advance(done)
+        for future in done:
+            self._resolve(future, True)
+
+    def _advance(self, done):
+        current = self._current
+        if current is not None:
+            # Hold the step only once it has been captured into a motoring packet
+            if self._robot._motoring_count <= self._written_count:
+                return
+            if self._remaining > 0:
+                self._remaining -= 1
+                if self._remaining > 0:
+                    return
+        while True:
+            if current is None:
+                current = self._next()
+                if current is None:
+                    return
+            values, hold_ticks, future = current
+            step = self._step
+            if step < len(values):
+                self._robot.write(self._device_id, values[step])
+                self._step = step + 1
+                self._remaining = hold_ticks
+                self._written_count = self._robot._motoring_count
+                return
+            self._current = None
+            done.append(future)
+            current = None
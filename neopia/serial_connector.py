@@ -17,6 +17,7 @@
 # Boston, MA  02111-1307  USA
 
 import sys
+import threading
 from timeit import default_timer as timer
 
 import serial.tools.list_ports
@@ -32,6 +33,9 @@ TIMEOUT = 0.5
 START_BYTES = bytearray([0xab, 0xcd])
 
 class SerialConnector(object):
+    _claimed_ports = set()
+    _claim_lock = threading.Lock()
+
     def __init__(self, tag, connection_checker, loader=None):
         self._tag = tag
         self._connection_checker = connection_checker
@@ -43,26 +47,38 @@ class SerialConnector(object):
         self._timestamp = 0
         self._connected = False
 
+    @staticmethod
+    def _claim_port(port_name):
+        # Robots connecting at the same time must never probe the same port
+        with SerialConnector._claim_lock:
+            if port_name in SerialConnector._claimed_ports:
+                return False
+            SerialConnector._claimed_ports.add(port_name)
+            return True
+
+    @staticmethod
+    def _release_port(port_name):
+        with SerialConnector._claim_lock:
+            SerialConnector._claimed_ports.discard(port_name)
+
     def open(self, port_name=None, reg_robots=None):
+        # Ports of the registered robots are claimed already, so reg_robots is kept for compatibility only
         if port_name:
-            result = self._open_port(port_name)
-            if result != Result.NOT_AVAILABLE:
-                return result
+            if SerialConnector._claim_port(port_name):
+                result = self._open_port(port_name)
+                if result != Result.NOT_AVAILABLE:
+                    return result
+                SerialConnector._release_port(port_name)
         else:
-            # Get all using ports
-            if reg_robots:
-                reg_ports = []
-                [reg_ports.append(robot._neobot._connector._port_name) for robot in reg_robots]
             # Get all ports on the computer
             ports = serial.tools.list_ports.comports()
 
             for port in ports:
-                if reg_ports and (port[0] in reg_ports):
-                    continue
-                else:
+                if SerialConnector._claim_port(port[0]):
                     result = self._open_port(port[0])
                     if result != Result.NOT_AVAILABLE:
                         return result
+                    SerialConnector._release_port(port[0])
         self._print_error("No available USB to BLE bridge")
         return Result.NOT_AVAILABLE
 
@@ -94,6 +110,7 @@ class SerialConnector(object):
         if self._serial:
             self._serial.close()
             self._serial = None
+            SerialConnector._release_port(self._port_name)
         self._print_message("Disposed")
 
     def is_connected(self):
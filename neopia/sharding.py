@@ -0,0 +1,259 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import os
+import pickle
+import threading
+import time
+import itertools
+import multiprocessing
+from concurrent.futures import Future
+from timeit import default_timer as timer
+
+from neopia.runner import Runner
+from neopia.neosoco import Neosoco
+from neopia.neosoco_group import NeosocoGroup
+from neopia.shared_bus import SharedBus
+from neopia.shared_bus import SENSOR_IDS
+
+
+class ShardHandle(object):
+    # Stands in for a Future, Motion or Melody still running in a shard, ShardedFleet.poll() and
+    # ShardedFleet.result() ask the shard about it
+    def __init__(self, handle_id):
+        self._id = handle_id
+        self._shard = -1
+
+    def get_id(self):
+        return self._id
+
+    def get_shard(self):
+        return self._shard
+
+
+def _picklable(value):
+    try:
+        pickle.dumps(value)
+    except Exception:
+        # Anything that can't be pickled is reported by its description
+        value = repr(value)
+    return value
+
+
+def _future_result(future):
+    try:
+        return future.result(0)
+    except Exception as e:
+        return _picklable(e)
+
+
+def _portable(value, handles, ids):
+    # Futures of asynchronous commands and the Motion and Melody handles holding one can't cross
+    # the pipe. A finished one sends its result, a running one is kept here and sent as a handle.
+    if not isinstance(value, Future) and hasattr(value, 'get_future'):
+        value = value.get_future()
+    if isinstance(value, Future):
+        if value.done():
+            return _future_result(value)
+        handle_id = next(ids)
+        handles[handle_id] = value
+        return ShardHandle(handle_id)
+    return _picklable(value)
+
+
+def _shard_main(conn, bus_name, indices, slots, factory):
+    # Every shard is a process of its own: its own Runner thread, serial threads and interpreter lock
+    bus = SharedBus.attach(bus_name)
+    robots = []
+    handles = {}
+    ids = itertools.count(1)
+    try:
+        try:
+            for index, slot in zip(indices, slots):
+                robot = factory(index)
+                bus.attach_robot(slot, robot)
+                robots.append(robot)
+            group = NeosocoGroup(robots)
+        except Exception as e:
+            conn.send(('error', _picklable(e)))
+            return
+        conn.send(('ready', len(robots)))
+        while True:
+            message = conn.recv()
+            # Every request carries a sequence number that its reply repeats
+            if message[0] == 'broadcast':
+                sequence, method, args, kwargs, timeout = message[1:]
+                try:
+                    command = group.broadcast(method, *args, **kwargs)
+                    results = [_portable(result, handles, ids) for result in command.wait(timeout)]
+                    tick = command.get_tick()
+                except Exception as e:
+                    results = [_picklable(e)] * len(robots)
+                    tick = -1
+                conn.send(('result', sequence, tick, results))
+            elif message[0] == 'poll':
+                sequence, handle_id = message[1:]
+                future = handles.get(handle_id)
+                if future is None:
+                    conn.send(('poll', sequence, True, KeyError(handle_id)))
+                elif future.done():
+                    del handles[handle_id]
+                    conn.send(('poll', sequence, True, _future_result(future)))
+                else:
+                    conn.send(('poll', sequence, False, None))
+            elif message[0] == 'stop':
+                break
+    finally:
+        Runner.shutdown()
+        bus.close()
+        conn.send(('stopped',))
+
+
+class ShardedFleet(object):
+    # Robots are spread over worker processes round robin, state is aggregated through a SharedBus.
+    # A robot at position i of the fleet uses slot i of the bus.
+    def __init__(self, indices, shards=None, factory=Neosoco, start_method='spawn', timeout=30.0):
+        if isinstance(indices, int):
+            indices = range(indices)
+        indices = list(indices)
+        if shards is None:
+            shards = os.cpu_count() or 1
+        shards = max(1, min(int(shards), len(indices)))
+        self._indices = indices
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._bus = SharedBus.create(robots=len(indices))
+        self._shards = []
+        context = multiprocessing.get_context(start_method)
+        for shard in range(shards):
+            slots = list(range(shard, len(indices), shards))
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_main, args=(child_conn, self._bus.get_name(), [indices[slot] for slot in slots], slots, factory))
+            process.daemon = True
+            process.start()
+            self._shards.append((process, conn, slots))
+        for process, conn, slots in self._shards:
+            if conn.poll(timeout) == False:
+                self.shutdown()
+                raise RuntimeError('Shard not ready')
+            message = conn.recv()
+            if message[0] != 'ready':
+                self.shutdown()
+                raise RuntimeError('Shard failed to start: {!r}'.format(message[1] if len(message) > 1 else message[0]))
+
+    def __len__(self):
+        return len(self._indices)
+
+    def get_bus(self):
+        return self._bus
+
+    def get_shard_count(self):
+        return len(self._shards)
+
+    def _next_sequence(self):
+        self._sequence += 1
+        return self._sequence
+
+    def _receive(self, conn, sequence):
+        # A reply that came after its request timed out is stale, it is thrown away
+        while True:
+            if conn.poll(self._timeout) == False:
+                raise RuntimeError('Shard not responding')
+            reply = conn.recv()
+            if len(reply) > 1 and reply[1] == sequence:
+                return reply
+
+    def broadcast(self, method, *args, **kwargs):
+        # Every shard runs the command on its next Runner tick. Shards keep their own ticks,
+        # so robots of different shards are only as close as the pipes are fast.
+        # A command still running, as drive() or play_melody(), is returned as a ShardHandle.
+        if not method in NeosocoGroup._BROADCAST:
+            raise ValueError('Wrong value of method')
+        results = [None] * len(self._indices)
+        with self._lock:
+            sequence = self._next_sequence()
+            for process, conn, slots in self._shards:
+                conn.send(('broadcast', sequence, method, args, kwargs, self._timeout))
+            for shard, (process, conn, slots) in enumerate(self._shards):
+                reply = self._receive(conn, sequence)
+                for slot, result in zip(slots, reply[3]):
+                    if isinstance(result, ShardHandle):
+                        result._shard = shard
+                    results[slot] = result
+        return results
+
+    def poll(self, handle):
+        # Returns (done, result) of a command still running in a shard
+        with self._lock:
+            sequence = self._next_sequence()
+            conn = self._shards[handle.get_shard()][1]
+            conn.send(('poll', sequence, handle.get_id()))
+            reply = self._receive(conn, sequence)
+        return reply[2], reply[3]
+
+    def result(self, handle, timeout=None):
+        if not isinstance(handle, ShardHandle):
+            return handle
+        deadline = None if timeout is None else timer() + timeout
+        while True:
+            done, result = self.poll(handle)
+            if done:
+                return result
+            if deadline is not None and timer() > deadline:
+                raise TimeoutError()
+            time.sleep(0.02)
+
+    def __getattr__(self, name):
+        if name in NeosocoGroup._BROADCAST:
+            return lambda *args, **kwargs: self.broadcast(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    def get_values(self, port='in1'):
+        if not isinstance(port, str):
+            raise TypeError
+        device_id = Neosoco._INPUT_PORTS.get(port.lower())
+        if device_id is None:
+            raise ValueError('Wrong value of port')
+        index = SENSOR_IDS.index(device_id)
+        bus = self._bus
+        return [bus.read_sensor(slot, index) for slot in range(len(self._indices))]
+
+    def read_sensors(self, position):
+        return self._bus.read_sensors(position)
+
+    def stage_effectors(self, position, values):
+        self._bus.stage_effectors(position, values)
+
+    def shutdown(self):
+        shards = self._shards
+        self._shards = []
+        for process, conn, slots in shards:
+            try:
+                conn.send(('stop',))
+            except:
+                pass
+        for process, conn, slots in shards:
+            process.join(self._timeout)
+            if process.is_alive():
+                process.terminate()
+        bus = self._bus
+        if bus is not None:
+            self._bus = None
+            bus.close()
+            bus.unlink()
@@ -0,0 +1,229 @@
+# Part of the RoboticsWare project - https://roboticsware.uz
+# Copyright (C) 2022 RoboticsWare (neopia.uz@gmail.com)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330,
+# Boston, MA  02111-1307  USA
+
+import struct
+from timeit import default_timer as timer
+from multiprocessing import shared_memory
+
+from neopia.neosoco import Neosoco
+
+
+MAGIC = 0x4e425553
+VERSION = 1
+
+SENSOR_IDS = (Neosoco.INPUT_1, Neosoco.INPUT_2, Neosoco.INPUT_3, Neosoco.REMOCTL, Neosoco.BATTERY)
+EFFECTOR_IDS = (Neosoco.OUTPUT_1, Neosoco.OUTPUT_2, Neosoco.OUTPUT_3, Neosoco.LEFT_MOTOR, Neosoco.RIGHT_MOTOR, Neosoco.NOTE)
+
+# magic, version, robots, reserved
+_HEADER = struct.Struct('<IIII')
+# A slot is one cache line:
+#  0 sensory sequence (u32), 8 timestamp (f64), 16 sensors (8 x i16),
+# 32 effector sequence (u32), 40 effectors (8 x i16), 56 effector stage counts (8 x u8)
+SLOT_SIZE = 64
+_MAX_VALUES = 8
+_VALUES = [struct.Struct('<%dh' % count) for count in range(_MAX_VALUES + 1)]
+_COUNTS = struct.Struct('<%dB' % _MAX_VALUES)
+
+
+def _open_segment(name):
+    # An attaching process must not unlink the segment when it exits
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    from multiprocessing import resource_tracker
+    # A forked child shares the tracker of its parent, the registration there isn't ours to remove
+    inherited = getattr(resource_tracker._resource_tracker, '_fd', None) is not None
+    segment = shared_memory.SharedMemory(name=name)
+    if inherited == False:
+        try:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        except:
+            pass
+    return segment
+
+
+class SharedBus(object):
+    # Latest sensory values and staged effector values of a fleet in shared memory. Both halves
+    # of a slot are seqlocks: odd while being written, a reader retries when it changed under it.
+    def __init__(self, segment, owner=False, lock=None):
+        self._segment = segment
+        self._owner = owner
+        self._lock = lock
+        buffer = segment.buf
+        magic, version, robots, reserved = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Wrong shared bus')
+        self._robots = robots
+        # Indexes of each slot in the typed views: sensory sequence, timestamp, effector sequence,
+        # and the byte offsets of the sensors, the effectors and their stage counts
+        self._slots = []
+        for slot in range(robots):
+            base = _HEADER.size + slot * SLOT_SIZE
+            self._slots.append((base // 4, (base + 8) // 8, base + 16, (base + 32) // 4, base + 40, base + 56))
+        self._buffer = buffer
+        self._u32 = buffer.cast('I')
+        self._i16 = buffer.cast('h')
+        self._f64 = buffer.cast('d')
+
+    @staticmethod
+    def create(name=None, robots=8, lock=None):
+        segment = shared_memory.SharedMemory(name=name, create=True, size=_HEADER.size + robots * SLOT_SIZE)
+        segment.buf[:] = bytes(segment.size)
+        _HEADER.pack_into(segment.buf, 0, MAGIC, VERSION, robots, 0)
+        return SharedBus(segment, True, lock)
+
+    @staticmethod
+    def attach(name, lock=None):
+        return SharedBus(_open_segment(name), False, lock)
+
+    def get_name(self):
+        return self._segment.name
+
+    def get_robots(self):
+        return self._robots
+
+    def publish_sensors(self, slot, values, timestamp=None):
+        # Only the owner process writes sensors
+        sequence, time_index, start, _, _, _ = self._slots[slot]
+        u32 = self._u32
+        seq = u32[sequence]
+        u32[sequence] = (seq + 1) & 0xffffffff
+        _VALUES[len(values)].pack_into(self._buffer, start, *values)
+        self._f64[time_index] = timer() if timestamp is None else timestamp
+        u32[sequence] = (seq + 2) & 0xffffffff
+
+    def read_sensors(self, slot, count=len(SENSOR_IDS)):
+        # Returns (values, timestamp, sequence) of a consistent snapshot
+        sequence, time_index, start, _, _, _ = self._slots[slot]
+        u32 = self._u32
+        while True:
+            seq = u32[sequence]
+            if seq & 1:
+                continue
+            values = _VALUES[count].unpack_from(self._buffer, start)
+            timestamp = self._f64[time_index]
+            if u32[sequence] == seq:
+                return values, timestamp, seq
+
+    def read_sensor(self, slot, index):
+        # A single aligned 16-bit value is never torn, so it needs no sequence check
+        return self._i16[self._slots[slot][2] // 2 + index]
+
+    def stage_effectors(self, slot, values):
+        # values is ordered as EFFECTOR_IDS, None leaves a field as it is, or a dict by effector id.
+        # Only the staged fields are written to the robot. A seqlock has one writer, pass a shared
+        # lock when several processes stage into a slot.
+        if isinstance(values, dict):
+            staged = [None] * len(EFFECTOR_IDS)
+            for device_id, value in values.items():
+                if not device_id in EFFECTOR_IDS:
+                    raise ValueError('Wrong effector id')
+                staged[EFFECTOR_IDS.index(device_id)] = value
+            values = staged
+        if len(values) > _MAX_VALUES:
+            raise ValueError('Too many values')
+        _, _, _, sequence, start, counts_start = self._slots[slot]
+        buffer = self._buffer
+        lock = self._lock
+        if lock is not None:
+            lock.acquire()
+        try:
+            u32 = self._u32
+            seq = u32[sequence]
+            if seq & 1:
+                seq += 1
+            u32[sequence] = (seq + 1) & 0xffffffff
+            current = list(_VALUES[_MAX_VALUES].unpack_from(buffer, start))
+            for i, value in enumerate(values):
+                if value is not None:
+                    current[i] = value
+                    buffer[counts_start + i] = (buffer[counts_start + i] + 1) & 0xff
+            _VALUES[_MAX_VALUES].pack_into(buffer, start, *current)
+            u32[sequence] = (seq + 2) & 0xffffffff
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def read_effectors(self, slot, count=len(EFFECTOR_IDS)):
+        # Returns (values, version), the version only changes when someone staged
+        values, counts, version = self.read_staged_effectors(slot, count)
+        return values, version
+
+    def read_staged_effectors(self, slot, count=len(EFFECTOR_IDS)):
+        # Returns (values, counts, version), the count of a field changes each time it is staged
+        _, _, _, sequence, start, counts_start = self._slots[slot]
+        u32 = self._u32
+        while True:
+            seq = u32[sequence]
+            if seq & 1:
+                continue
+            values = _VALUES[count].unpack_from(self._buffer, start)
+            counts = _COUNTS.unpack_from(self._buffer, counts_start)[:count]
+            if u32[sequence] == seq:
+                return values, counts, seq
+
+    def attach_robot(self, slot, robot):
+        # In the owner process, the robot publishes its sensors as soon as a packet is decoded
+        # and applies staged effectors on every Runner tick
+        if slot < 0 or slot >= self._robots:
+            raise IndexError('Wrong slot')
+        task = SharedBusTask(self, slot, robot)
+        robot._add_tick_task(task)
+        robot._neobot._add_sensory_task(task)
+        return task
+
+    def close(self):
+        if self._u32 is not None:
+            for view in (self._u32, self._i16, self._f64):
+                view.release()
+            self._u32 = self._i16 = self._f64 = self._buffer = None
+            self._segment.close()
+
+    def unlink(self):
+        if self._owner:
+            self._segment.unlink()
+
+
+class SharedBusTask(object):
+    def __init__(self, bus, slot, robot):
+        self._bus = bus
+        self._slot = slot
+        self._robot = robot
+        values, self._counts, self._version = bus.read_staged_effectors(slot)
+        self._devices = [robot.find_device_by_id(device_id) for device_id in SENSOR_IDS]
+
+    def detach(self):
+        self._robot._remove_tick_task(self)
+        self._robot._neobot._remove_sensory_task(self)
+
+    def _received(self, timestamp):
+        # On the serial thread, so readers see a packet without waiting for the next Runner tick
+        self._bus.publish_sensors(self._slot, [device._data[0] for device in self._devices], timestamp)
+
+    def _tick(self, tick):
+        bus = self._bus
+        values, counts, version = bus.read_staged_effectors(self._slot)
+        if version != self._version:
+            self._version = version
+            # Only the fields staged since the last tick, so a command like NOTE isn't fired again
+            last = self._counts
+            self._counts = counts
+            writes = [(EFFECTOR_IDS[i], values[i]) for i in range(len(counts)) if counts[i] != last[i]]
+            if len(writes) > 0:
+                self._robot.write_many(writes)
@@ -0,0 +1,164 @@
+import sys
+import threading
+import time
+
+from neopia.model import Device
+from neopia.model import DeviceType
+from neopia.model import DataType
+from neopia.runner import Runner
+
+THREADS = 16
+ITERATIONS = 2000
+
+# Many threads write to one effector while the Runner side takes the written flag,
+# the last write is always taken and nothing is left behind
+def hammer_device_writes():
+  device = Device(0, 'Motor', DeviceType.EFFECTOR, DataType.INTEGER, 1, -100, 100, 0)
+  device.set_suppress_unchanged(False)
+  taken = [0]
+  stop = threading.Event()
+
+  def take():
+    while not stop.is_set():
+      if device._take_written():
+        taken[0] += 1
+    if device._take_written():
+      taken[0] += 1
+
+  def write(seed):
+    for i in range(ITERATIONS):
+      device.write((seed + i) % 201 - 100)
+
+  taker = threading.Thread(target=take)
+  taker.start()
+  writers = [threading.Thread(target=write, args=(n,)) for n in range(THREADS)]
+  for thread in writers: thread.start()
+  for thread in writers: thread.join()
+  stop.set()
+  taker.join()
+  assert taken[0] > 0
+  assert device._take_written() == False
+  assert -100 <= device.read() <= 100
+  print('device writes ok, {} takes'.format(taken[0]))
+
+# Sensor updates and notifications race listeners being added and removed
+def hammer_device_notify():
+  device = Device(1, 'Sensor', DeviceType.SENSOR, DataType.INTEGER, 1, 0, 255, 0)
+  counts = []
+  lock = threading.Lock()
+  stop = threading.Event()
+
+  def put():
+    value = 0
+    while not stop.is_set():
+      value = (value + 1) % 256
+      device._put(value)
+      device._notify_device_data_changed()
+
+  def listen(n):
+    for i in range(ITERATIONS // 10):
+      count = [0]
+      def listener(d, data, count=count):
+        count[0] += 1
+      device.add_device_data_changed_listener(listener)
+      device.remove_device_data_changed_listener(listener)
+    with lock:
+      counts.append(n)
+
+  putters = [threading.Thread(target=put) for n in range(4)]
+  for thread in putters: thread.start()
+  listeners = [threading.Thread(target=listen, args=(n,)) for n in range(THREADS)]
+  for thread in listeners: thread.start()
+  for thread in listeners: thread.join()
+  stop.set()
+  for thread in putters: thread.join()
+  assert len(counts) == THREADS
+  print('device notify ok')
+
+# Robots come and go from many threads, every one still registered at the end is ticked
+class CountingRobot(object):
+  def __init__(self):
+    self.ticks = 0
+
+  def _update_sensory_device_state(self): pass
+  def _update_motoring_device_state(self): pass
+  def _notify_sensory_device_data_changed(self): pass
+  def _notify_motoring_device_data_changed(self):
+    self.ticks += 1
+  def _request_motoring_data(self): pass
+  def _run_tick_tasks(self, tick): pass
+  def _clear_written(self): pass
+  def _is_connected(self):
+    return False
+  def dispose(self): pass
+
+def hammer_runner_robots():
+  kept = []
+  lock = threading.Lock()
+
+  def churn(n):
+    for i in range(ITERATIONS // 10):
+      robot = CountingRobot()
+      Runner.register_robot(robot)
+      if i % 2:
+        Runner.unregister_robot(robot)
+      else:
+        with lock:
+          kept.append(robot)
+
+  threads = [threading.Thread(target=churn, args=(n,)) for n in range(THREADS)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  time.sleep(0.2)
+  robots = Runner.get_robots()
+  for robot in kept:
+    assert robot in robots
+    assert robot.ticks > 0
+  assert len(robots) == len(kept)
+  for robot in kept:
+    Runner.unregister_robot(robot)
+  time.sleep(0.1)
+  assert len(Runner.get_robots()) == 0
+  print('runner robots ok, {} robots'.format(len(kept)))
+
+# Evaluations are added from many threads while the Runner checks them
+def hammer_evaluations():
+  fired = [0]
+  lock = threading.Lock()
+  counter = [0]
+
+  def bump():
+    with lock:
+      fired[0] += 1
+
+  def wait(n):
+    for i in range(20):
+      target = counter[0] + 2
+      Runner.wait_until(lambda target=target: counter[0] >= target)
+      assert counter[0] >= target
+    bump()
+
+  def count():
+    while fired[0] < THREADS:
+      counter[0] += 1
+      time.sleep(0.001)
+
+  counting = threading.Thread(target=count)
+  counting.start()
+  threads = [threading.Thread(target=wait, args=(n,)) for n in range(THREADS)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  counting.join()
+  assert fired[0] == THREADS
+  print('evaluations ok')
+
+if __name__ == '__main__':
+  sys.setswitchinterval(1e-6)
+  gil = sys._is_gil_enabled() if hasattr(sys, '_is_gil_enabled') else True
+  print('python {}, GIL {}'.format(sys.version.split()[0], 'enabled' if gil else 'disabled'))
+  Runner.start()
+  hammer_device_writes()
+  hammer_device_notify()
+  hammer_runner_robots()
+  hammer_evaluations()
+  Runner.shutdown()
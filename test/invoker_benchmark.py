@@ -0,0 +1,63 @@
+from timeit import default_timer as timer
+
+from neopia.runner import Evaluation
+from neopia.runner import Evaluator
+
+CALLS = 200000
+
+# how conditions and callbacks used to be called: __func__ first, the callable itself when that raised
+def legacy_call(fn, arg):
+  try:
+    if arg is not None:
+      return fn.__func__(arg)
+    return fn.__func__()
+  except:
+    if arg is not None:
+      return fn(arg)
+    return fn()
+
+class Robot(object):
+  def __init__(self):
+    self.value = 0
+
+  def is_near(self, limit=10):
+    return self.value > limit
+
+def condition():
+  return False
+
+def condition_with_arg(arg):
+  return arg > 10
+
+robot = Robot()
+cases = [
+  ('function', condition, None),
+  ('function(arg)', condition_with_arg, 5),
+  ('lambda', lambda: robot.value > 10, None),
+  ('bound method', robot.is_near, None),
+]
+
+def per_call(run):
+  start = timer()
+  run()
+  return (timer() - start) / CALLS * 1e9
+
+# before and after are the cost of calling the condition, check adds the bookkeeping of a Runner tick
+print('{} calls, ns per call'.format(CALLS))
+print('{:<16} {:>8} {:>8} {:>8}'.format('', 'before', 'after', 'check'))
+for name, fn, arg in cases:
+  def before():
+    for i in range(CALLS):
+      legacy_call(fn, arg)
+  evaluation = Evaluation(fn)
+  evaluation._set_arg(arg)
+  Evaluator()._add(evaluation)
+  def after():
+    call = evaluation._evaluate
+    for i in range(CALLS):
+      call()
+  def check():
+    run = evaluation._check
+    for i in range(CALLS):
+      run()
+  print('{:<16} {:8.0f} {:8.0f} {:8.0f}'.format(name, per_call(before), per_call(after), per_call(check)))
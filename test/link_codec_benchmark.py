@@ -0,0 +1,54 @@
+import json
+import random
+from timeit import default_timer as timer
+
+from neopia.linker import Linker
+from neopia.neosoco import Neosoco
+from neopia.neosoco_neobot import NeosocoLinkNeobot
+
+ROBOTS = 8
+TICKS = 5000
+
+# stands in for the websocket app of the bridge, it only counts what would go on the wire
+class WebSocketStandIn(object):
+  def __init__(self):
+    self.frames = 0
+    self.bytes = 0
+
+  def send(self, data, opcode=None):
+    self.frames += 1
+    self.bytes += len(data)
+
+neobots = []
+for index in range(ROBOTS):
+  neobot = NeosocoLinkNeobot(index)
+  Linker.register_neobot('neosoco', 'neosoco', index, 'Neosoco[{}]'.format(index), neobot)
+  neobots.append(neobot)
+
+def sensory(index, tick):
+  return json.dumps({'module': 'neosoco', 'index': index, 'connectionState': 2, 'input1': tick % 256,
+    'input2': random.randint(0, 255), 'input3': 0, 'remoteControl': 0, 'battery': 200})
+
+def run(delta):
+  Linker.set_delta_encoding(delta)
+  wsapp = WebSocketStandIn()
+  start = timer()
+  for tick in range(TICKS):
+    # most robots idle, one of them drives
+    moving = neobots[tick % ROBOTS]
+    moving._left_motor_device.write(tick % 48)
+    moving._right_motor_device.write(tick % 48)
+    for neobot in neobots:
+      neobot._request_motoring_data()
+      neobot.encode_motoring()
+    data = Linker._encode()
+    if data is not None:
+      wsapp.send(data)
+    for index in range(ROBOTS):
+      neobots[index].decode_sensory(json.loads(sensory(index, tick)))
+  elapsed = timer() - start
+  print('{:<6} {:8.1f} us/tick {:8.1f} bytes/tick'.format('delta' if delta else 'full', elapsed / TICKS * 1e6, wsapp.bytes / TICKS))
+
+print('{} robots, {} ticks'.format(ROBOTS, TICKS))
+run(False)
+run(True)
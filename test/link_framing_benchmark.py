@@ -0,0 +1,72 @@
+import json
+import random
+from timeit import default_timer as timer
+
+from neopia.framing import BinaryFraming, FRAME_SENSORY, _HEADER, _ROBOT, MAGIC, VERSION
+from neopia.linker import Link
+from neopia.neosoco_neobot import NeosocoLinkNeobot
+
+ROBOTS = 8
+MOTORING_FIELDS = 48
+SENSORY_FIELDS = 24
+TICKS = 2000
+
+# a motoring map like the ones the link neobots keep, every robot has the same layout
+motoring_fields = ['field%d' % i for i in range(MOTORING_FIELDS)]
+sensory_fields = ['sensor%d' % i for i in range(SENSORY_FIELDS)]
+packet = {}
+for index in range(ROBOTS):
+  motoring = {'module': 'neosoco', 'index': index}
+  for field in motoring_fields:
+    motoring[field] = random.randint(0, 255)
+  packet['neosoco' + str(index)] = motoring
+
+framing = BinaryFraming()
+framing.register_motoring('neosoco', motoring_fields)
+framing.register_sensory('neosoco', sensory_fields)
+
+# sensory messages as the bridge sends them, one JSON message per robot or one binary frame for all
+json_messages = []
+records = []
+sensory_schema = framing._sensory_by_id[0]
+for index in range(ROBOTS):
+  received = {'module': 'neosoco', 'index': index}
+  values = [random.randint(0, 255) for field in sensory_fields]
+  received.update(zip(sensory_fields, values))
+  json_messages.append(json.dumps(received))
+  records.append(_ROBOT.pack(0, index) + sensory_schema._struct.pack(*values))
+binary_frame = _HEADER.pack(MAGIC, VERSION, FRAME_SENSORY, 0, 0, ROBOTS) + b''.join(records)
+
+def measure(name, function):
+  start = timer()
+  for i in range(TICKS):
+    result = function()
+  elapsed = (timer() - start) / TICKS * 1e6
+  print('{:<16} {:8.1f} us/tick'.format(name, elapsed))
+  return result
+
+print('{} robots, {} motoring and {} sensory fields, {} ticks'.format(ROBOTS, MOTORING_FIELDS, SENSORY_FIELDS, TICKS))
+text = measure('json encode', lambda: json.dumps(packet))
+data = measure('binary encode', lambda: framing.encode_motoring(packet))
+measure('json decode', lambda: [json.loads(message) for message in json_messages])
+measure('binary decode', lambda: framing.decode_sensory(binary_frame))
+print('motoring bytes per tick: json {}, binary {}'.format(len(text.encode()), len(data)))
+print('sensory bytes per tick: json {}, binary {}'.format(sum(len(m) for m in json_messages), len(binary_frame)))
+
+# a frame with the fields of the Neosoco codec, decoded and handed to the links as the decode thread does
+neosoco_fields = [field for field, device in NeosocoLinkNeobot._SENSORY_FIELDS]
+neosoco_framing = BinaryFraming()
+neosoco_framing.register_sensory('neosoco', neosoco_fields)
+neosoco_schema = neosoco_framing._sensory_by_id[0]
+links = [Link('Neosoco[{}]'.format(index), NeosocoLinkNeobot(index)) for index in range(ROBOTS)]
+neosoco_frame = _HEADER.pack(MAGIC, VERSION, FRAME_SENSORY, 0, 0, ROBOTS) + b''.join(
+  _ROBOT.pack(0, index) + neosoco_schema._struct.pack(*[index + 1] * len(neosoco_fields)) for index in range(ROBOTS))
+
+def decode_to_links():
+  for received in neosoco_framing.decode_sensory(neosoco_frame):
+    links[received['index']].handle_sensory(received)
+
+measure('binary to links', decode_to_links)
+for index, link in enumerate(links):
+  assert link._neobot._ready
+  assert link._neobot._input_1_device.read() == index + 1
@@ -0,0 +1,60 @@
+from timeit import default_timer as timer
+
+from neopia.runner import Runtime
+from neopia.neosoco import Neosoco
+from neopia.neosoco_neobot import NeosocoNeobot
+
+MELODY = [('3', 'c', '4'), ('3', 'e', '8'), ('3', 'g', '8'), ('3', 0, '4'), ('4', 'c', '2'), ('3', 'b', '8'), ('3', 'a', '8')]
+BPM = 120
+
+# no serial port, the runtime only ticks the robot
+class SimulatedNeosoco(Neosoco):
+  def _init(self, port_name):
+    neobot = self._neobot = NeosocoNeobot(self.get_index(), self._runtime)
+    self._add_neobot(neobot)
+    self._runtime.register_robot(self)
+    self._runtime.start()
+
+# added after the melody player, so on every tick it sees what the player wrote in that tick
+class NoteRecorder(object):
+  def __init__(self, robot):
+    self._robot = robot
+    self.changes = []
+    self._value = 0
+
+  def _tick(self, tick):
+    value = self._robot.read(Neosoco.NOTE)
+    if value != self._value:
+      self._value = value
+      self.changes.append((tick, timer(), value))
+
+def run(period_ms):
+  runtime = Runtime('melody', period_ms)
+  robot = SimulatedNeosoco(0, runtime=runtime)
+  recorder = NoteRecorder(robot)
+  robot._add_tick_task(recorder)
+  melody = robot.play_melody(MELODY, bpm=BPM)
+  melody.wait(30)
+  start_tick = melody.get_start_tick()
+  # the changes the compiled events ask for, at the tick they ask for
+  expected = []
+  value = 0
+  for offset, note in melody._events:
+    if note != value:
+      value = note
+      expected.append((start_tick + offset, note))
+  if value != 0:
+    expected.append((start_tick + melody.get_length(), 0))
+  actual = [(tick, note) for tick, at, note in recorder.changes]
+  tick_errors = [a[0] - e[0] for a, e in zip(actual, expected)]
+  # wall clock of each change against the first one and the nominal period
+  first_tick, first_time = recorder.changes[0][0], recorder.changes[0][1]
+  jitter = [abs((at - first_time) * 1000.0 - (tick - first_tick) * period_ms) for tick, at, note in recorder.changes]
+  runtime.shutdown()
+  assert len(actual) == len(expected), (actual, expected)
+  print('{:>3} ms tick {:>3} changes, tick error max {}, wall clock jitter max {:5.1f} ms'.format(
+    period_ms, len(actual), max(abs(e) for e in tick_errors), max(jitter)))
+
+print('{} notes at {} bpm'.format(len(MELODY), BPM))
+for period_ms in (20, 10):
+  run(period_ms)
@@ -0,0 +1,66 @@
+import os
+import time
+import threading
+from timeit import default_timer as timer
+
+from neopia.runner import Runner
+from neopia.neosoco import Neosoco
+from neopia.neosoco_neobot import NeosocoNeobot
+from neopia.sharding import ShardedFleet
+
+ROBOTS = 128
+SECONDS = 5
+PACKET_MS = 10
+
+# stands in for the serial port, the controller sends a sensory packet every 10 ms
+class SimulatedConnector(object):
+  def __init__(self):
+    self._next = timer()
+    self._count = 0
+
+  def read(self):
+    now = timer()
+    if now < self._next:
+      return None
+    self._next = max(self._next + PACKET_MS / 1000.0, now - 0.1)
+    self._count += 1
+    return [0xCD, 0xAB, self._count % 256, 50, 0, 0, 200]
+
+  def write(self, packet):
+    pass
+
+  def close(self):
+    pass
+
+class SimulatedNeosoco(Neosoco):
+  def _init(self, port_name):
+    neobot = self._neobot = NeosocoNeobot(self.get_index())
+    self._add_neobot(neobot)
+    Runner.register_robot(self)
+    Runner.start()
+    neobot._connector = SimulatedConnector()
+    neobot._running = True
+    neobot._releasing = False
+    neobot._thread = threading.Thread(target=neobot._run)
+    neobot._thread.daemon = True
+    neobot._thread.start()
+
+def run(shards):
+  fleet = ShardedFleet(ROBOTS, shards, SimulatedNeosoco)
+  bus = fleet.get_bus()
+  time.sleep(1)
+  start = [bus.read_sensors(slot)[2] for slot in range(ROBOTS)]
+  time.sleep(SECONDS)
+  end = [bus.read_sensors(slot)[2] for slot in range(ROBOTS)]
+  fleet.broadcast('motor_stop')
+  fleet.shutdown()
+  # the sequence grows by 2 for every decoded packet the robot published, one every PACKET_MS
+  published = sum(e - s for s, e in zip(start, end)) / 2
+  return published / (ROBOTS * SECONDS * 1000.0 / PACKET_MS)
+
+if __name__ == '__main__':
+  print('{} simulated robots, {} cores'.format(ROBOTS, os.cpu_count()))
+  shards = 1
+  while shards <= (os.cpu_count() or 1):
+    print('{:>3} shards {:6.1%} of the packet rate'.format(shards, run(shards)))
+    shards *= 2